@@ -1,16 +1,74 @@
+import io
+import re
 import json
+import asyncio
+import atexit
 import sqlite3
 import datetime
 import os
+import hashlib
 import logging
+import threading
+import functools
+import time
+from collections import OrderedDict
 from typing import Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import PyPDF2
-from email.parser import Parser
+from email.parser import Parser, HeaderParser
 from email.policy import default
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+# orjson silently turns integers outside [-2**63, 2**64) into floats; every such literal has 19+ digits
+_WIDE_INT_RE = re.compile(r'\d{19,}')
+
+def _json_loads(text: str) -> Any:
+    """Parse JSON with orjson when it is installed, falling back to json for what orjson cannot represent.
+    
+    The stdlib parser keeps integers wider than 64 bits exact and accepts NaN/Infinity. Either way a
+    failure raises json.JSONDecodeError (orjson's error subclasses it).
+    """
+    if orjson and not (isinstance(text, str) and _WIDE_INT_RE.search(text)):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+def _json_dumps(value: Any) -> str:
+    """Serialize a value for storage, with orjson when it is installed"""
+    if orjson:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which json serializes exactly
+            pass
+    return json.dumps(value)
+
+def _parse_json_object(text: str) -> Optional[Dict]:
+    """Parse the JSON object in an LLM response, tolerating surrounding prose or code fences"""
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end < start:
+        return None
+    try:
+        value = _json_loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -24,78 +82,160 @@ class ProcessingResult:
     timestamp: str
     thread_id: str
     errors: list = None
+    context: Dict[str, Any] = None
 
 class SharedMemory:
     """Lightweight shared memory using SQLite"""
     
     def __init__(self, db_path: str = "shared_memory.db"):
         self.db_path = db_path
+        # One autocommit connection in WAL mode, shared across threads and serialized by the lock
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA temp_store=MEMORY')
+        self._lock = threading.Lock()
+        # Log rows are written in groups; reads of the log flush first so they never miss a row
+        self._log_buffer = []
+        self._buffer_max = 100
+        atexit.register(self._flush_logs)
         self.init_db()
     
     def init_db(self):
         """Initialize the database tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS processing_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                thread_id TEXT,
-                source_type TEXT,
-                intent TEXT,
-                timestamp TEXT,
-                agent_type TEXT,
-                extracted_data TEXT,
-                status TEXT,
-                errors TEXT
+        with self._lock:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS processing_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    thread_id TEXT,
+                    source_type TEXT,
+                    intent TEXT,
+                    timestamp TEXT,
+                    agent_type TEXT,
+                    extracted_data TEXT,
+                    status TEXT,
+                    errors TEXT
+                )
+            ''')
+            
+            # History reads are newest-first, per thread or across all threads; a reverse scan of
+            # these indexes yields (timestamp, id) descending, so the id tie-break needs no sort
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_logs_thread_ts ON processing_logs(thread_id, timestamp)'
             )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS context_store (
-                thread_id TEXT PRIMARY KEY,
-                sender TEXT,
-                topic TEXT,
-                last_extracted_fields TEXT,
-                created_at TEXT,
-                updated_at TEXT
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_logs_ts ON processing_logs(timestamp)'
             )
-        ''')
-        
-        conn.commit()
-        conn.close()
+            
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS context_store (
+                    thread_id TEXT PRIMARY KEY,
+                    sender TEXT,
+                    topic TEXT,
+                    last_extracted_fields TEXT,
+                    created_at TEXT,
+                    updated_at TEXT
+                )
+            ''')
+            
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT,
+                    created_at TEXT,
+                    expires_at TEXT
+                )
+            ''')
+            
+            # Expired responses are never read again, so drop them on open to keep the file bounded
+            self._conn.execute('DELETE FROM response_cache WHERE expires_at <= ?', (_utc_now_iso(),))
+    
+    def close(self):
+        """Flush buffered log rows and close the database connection"""
+        atexit.unregister(self._flush_logs)
+        with self._lock:
+            self._write_logs()
+            self._conn.close()
     
     def log_processing(self, result: ProcessingResult):
         """Log processing result"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        row = self._log_row(result)
+        with self._lock:
+            self._log_buffer.append(row)
+            if len(self._log_buffer) >= self._buffer_max:
+                self._write_logs()
+    
+    def log_and_update(self, result: ProcessingResult):
+        """Log a result and store the thread context it carries, committing both in one transaction"""
+        if not result.context:
+            self.log_processing(result)
+            return
         
-        cursor.execute('''
-            INSERT INTO processing_logs 
-            (thread_id, source_type, intent, timestamp, agent_type, extracted_data, status, errors)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        row = self._log_row(result)
+        with self._lock:
+            self._log_buffer.append(row)
+            self._conn.execute('BEGIN')
+            try:
+                self._insert_logs()
+                self._upsert_context(result.thread_id, now=result.timestamp, **result.context)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._log_buffer.clear()
+    
+    def _log_row(self, result: ProcessingResult) -> tuple:
+        """Column values of the processing_logs row for a result"""
+        return (
             result.thread_id,
             result.classification.get('format', ''),
             result.classification.get('intent', ''),
             result.timestamp,
             result.agent_type,
-            json.dumps(result.data),
+            _json_dumps(result.data),
             'success' if result.success else 'failed',
-            json.dumps(result.errors or [])
-        ))
-        
-        conn.commit()
-        conn.close()
+            _json_dumps(result.errors or [])
+        )
+    
+    def _flush_logs(self):
+        """Write any buffered log rows to the database"""
+        with self._lock:
+            self._write_logs()
+    
+    def _write_logs(self):
+        """Insert the buffered log rows in one transaction; the caller holds the lock"""
+        if not self._log_buffer:
+            return
+        self._conn.execute('BEGIN')
+        try:
+            self._insert_logs()
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._log_buffer.clear()
+    
+    def _insert_logs(self):
+        """Insert the buffered log rows inside the caller's transaction"""
+        self._conn.executemany('''
+            INSERT INTO processing_logs 
+            (thread_id, source_type, intent, timestamp, agent_type, extracted_data, status, errors)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', self._log_buffer)
     
     def update_context(self, thread_id: str, sender: str = None, topic: str = None, 
-                      extracted_fields: Dict = None):
+                      extracted_fields: Dict = None, now: str = None):
         """Update shared context for a thread"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()     
-        now = datetime.datetime.now().isoformat()
-        cursor.execute('SELECT thread_id FROM context_store WHERE thread_id = ?', (thread_id,))
-        exists = cursor.fetchone()
+        now = now or _utc_now_iso()
+        with self._lock:
+            self._upsert_context(thread_id, sender, topic, extracted_fields, now)
+    
+    def _upsert_context(self, thread_id: str, sender: str = None, topic: str = None,
+                        extracted_fields: Dict = None, now: str = None):
+        """Insert or update a context_store row; the caller holds the lock"""
+        exists = self._conn.execute(
+            'SELECT thread_id FROM context_store WHERE thread_id = ?', (thread_id,)
+        ).fetchone()
         
         if exists:
             updates = []
@@ -109,18 +249,18 @@ class SharedMemory:
                 params.append(topic)
             if extracted_fields:
                 updates.append('last_extracted_fields = ?')
-                params.append(json.dumps(extracted_fields))
+                params.append(_json_dumps(extracted_fields))
             
             updates.append('updated_at = ?')
             params.append(now)
             params.append(thread_id)
             
-            cursor.execute(f'''
+            self._conn.execute(f'''
                 UPDATE context_store SET {', '.join(updates)}
                 WHERE thread_id = ?
             ''', params)
         else:
-            cursor.execute('''
+            self._conn.execute('''
                 INSERT INTO context_store 
                 (thread_id, sender, topic, last_extracted_fields, created_at, updated_at)
                 VALUES (?, ?, ?, ?, ?, ?)
@@ -128,59 +268,175 @@ class SharedMemory:
                 thread_id,
                 sender or '',
                 topic or '',
-                json.dumps(extracted_fields or {}),
+                _json_dumps(extracted_fields or {}),
                 now,
                 now
             ))
-        
-        conn.commit()
-        conn.close()
-    
+
     def get_context(self, thread_id: str) -> Dict:
         """Get context for a thread"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT sender, topic, last_extracted_fields, created_at, updated_at
-            FROM context_store WHERE thread_id = ?
-        ''', (thread_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
+        with self._lock:
+            result = self._conn.execute('''
+                SELECT sender, topic, last_extracted_fields, created_at, updated_at
+                FROM context_store WHERE thread_id = ?
+            ''', (thread_id,)).fetchone()
         
         if result:
             return {
                 'sender': result[0],
                 'topic': result[1],
-                'last_extracted_fields': json.loads(result[2]) if result[2] else {},
+                'last_extracted_fields': _json_loads(result[2]) if result[2] else {},
                 'created_at': result[3],
                 'updated_at': result[4]
             }
         return {}
+    
+    def get_processing_history(self, thread_id: str = None, limit: Optional[int] = None) -> list:
+        """Get processing history, newest first (last 50 entries unless a thread or limit is given)"""
+        if thread_id:
+            query = 'SELECT * FROM processing_logs WHERE thread_id = ? ORDER BY timestamp DESC, id DESC'
+            params = [thread_id]
+        else:
+            query = 'SELECT * FROM processing_logs ORDER BY timestamp DESC, id DESC'
+            params = []
+            if limit is None:
+                limit = 50
+        
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        with self._lock:
+            self._write_logs()
+            cursor = self._conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            results = cursor.execute(query, params).fetchall()
+        
+        return [dict(row) for row in results]
+
+    def get_cached_response(self, key: str) -> Optional[str]:
+        """Get a cached LLM response if it has not expired"""
+        with self._lock:
+            result = self._conn.execute('''
+                SELECT response FROM response_cache WHERE key = ? AND expires_at > ?
+            ''', (key, _utc_now_iso())).fetchone()
+        
+        return result[0] if result else None
+    
+    def store_cached_response(self, key: str, response: str, ttl_seconds: int):
+        """Cache an LLM response for ttl_seconds"""
+        # UTC like every other stored timestamp, so expiry does not shift with the local zone or DST
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            self._conn.execute('''
+                INSERT OR REPLACE INTO response_cache (key, response, created_at, expires_at)
+                VALUES (?, ?, ?, ?)
+            ''', (
+                key,
+                response,
+                now.isoformat(),
+                (now + datetime.timedelta(seconds=ttl_seconds)).isoformat()
+            ))
+
+def _utc_now_iso() -> str:
+    """Current UTC time as an ISO 8601 string"""
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+@functools.lru_cache(maxsize=256)
+def _field_checks(field: str) -> Tuple[bool, bool]:
+    """Which value checks apply to an extracted field name: (numeric amount, date)"""
+    field = field.lower()
+    return 'amount' in field or 'price' in field, 'date' in field
+
+@functools.lru_cache(maxsize=1)
+def _get_session(auth_header: str) -> requests.Session:
+    """Pooled session for an API key, shared by every LLMClient that uses that key"""
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": auth_header,
+        "Content-Type": "application/json"
+    })
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["POST"])
+    )
+    # One pool so calls reuse the TLS connection instead of reconnecting
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=retry))
+    return session
 
 class LLMClient:
     """OpenRouter API client"""
     
-    def __init__(self, api_key: str):
-        self.api_key = "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"
+    def __init__(self, api_key: str, cache: SharedMemory = None, cache_ttl: int = 86400,
+                 cache_size: int = 1024):
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._memory_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.api_key = api_key or os.environ.get("OPENROUTER_API_KEY")
+        if not self.api_key:
+            raise ValueError("No OpenRouter API key: pass api_key or set OPENROUTER_API_KEY")
         self.base_url = "https://openrouter.ai/api/v1/chat/completions"
-        self.headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+        self._auth_header = f"Bearer {self.api_key}"
+        self.session = _get_session(self._auth_header)
     
     def call(self, messages: list, model: str = "meta-llama/llama-3.1-8b-instruct:free") -> str:
-        """Make API call to OpenRouter"""
+        """Make API call to OpenRouter, answering repeated prompts from cache"""
+        key = hashlib.sha256((model + json.dumps(messages, sort_keys=True)).encode()).hexdigest()
+        
+        response = self._get_cached(key)
+        if response is None:
+            response = self._request(messages, model)
+            # Failed calls come back as "Error: ..." strings and must not be cached
+            if not response.startswith("Error: "):
+                self._store_cached(key, response)
+        
+        return response
+    
+    def _get_cached(self, key: str) -> Optional[str]:
+        """Look a response up in the in-memory LRU, then in shared memory"""
+        now = datetime.datetime.now().timestamp()
+        with self._cache_lock:
+            entry = self._memory_cache.get(key)
+            if entry and entry[0] > now:
+                self._memory_cache.move_to_end(key)
+                return entry[1]
+        
+        if self.cache:
+            response = self.cache.get_cached_response(key)
+            if response is not None:
+                self._remember(key, response)
+            return response
+        return None
+    
+    def _store_cached(self, key: str, response: str):
+        """Cache a response in memory and in shared memory"""
+        self._remember(key, response)
+        if self.cache:
+            self.cache.store_cached_response(key, response, self.cache_ttl)
+    
+    def _remember(self, key: str, response: str):
+        """Insert into the in-memory LRU, evicting the least recently used entry when full"""
+        with self._cache_lock:
+            self._memory_cache[key] = (datetime.datetime.now().timestamp() + self.cache_ttl, response)
+            self._memory_cache.move_to_end(key)
+            if len(self._memory_cache) > self.cache_size:
+                self._memory_cache.popitem(last=False)
+    
+    def _request(self, messages: list, model: str) -> str:
+        """Send a chat completion request to OpenRouter"""
         try:
             payload = {
                 "model": model,
-                "messages": messages,
+                "messages": self._with_cache_breakpoint(messages, model),
                 "max_tokens": 1000,
                 "temperature": 0.3
             }
             
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
+            response = self.session.post(self.base_url, json=payload, timeout=30)
             response.raise_for_status()
             
             result = response.json()
@@ -189,92 +445,387 @@ class LLMClient:
         except Exception as e:
             logger.error(f"LLM API call failed: {e}")
             return f"Error: {str(e)}"
+    
+    def _with_cache_breakpoint(self, messages: list, model: str) -> list:
+        """Mark the static system prompt cacheable for providers that need an explicit breakpoint"""
+        # OpenAI, DeepSeek and Gemini models cache shared prefixes automatically; Anthropic needs cache_control
+        if not model.startswith("anthropic/"):
+            return messages
+        return [
+            {"role": "system", "content": [
+                {"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}
+            ]} if message["role"] == "system" and isinstance(message["content"], str) else message
+            for message in messages
+        ]
+    
+    def close(self):
+        """Detach this client from its HTTP session.
+        
+        The pooled session from _get_session is shared by every client using the same key, so it is
+        left open for them rather than closed here.
+        """
+        self.session = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    async def call_async(self, messages: list, model: str = "meta-llama/llama-3.1-8b-instruct:free") -> str:
+        """Awaitable call() that runs the blocking request in a worker thread"""
+        return await asyncio.to_thread(self.call, messages, model)
+
+class BatchLLMClient:
+    """Client for OpenAI-compatible Batch APIs: prompts are uploaded as JSONL and completed asynchronously"""
+    
+    def __init__(self, api_key: str, base_url: str = "https://api.openai.com/v1", model: str = "gpt-4o-mini",
+                 poll_interval: float = 30.0, completion_window: str = "24h", max_wait: float = 3600.0):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.completion_window = completion_window
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+        self._queued = []
+    
+    def add(self, custom_id: str, messages: list):
+        """Queue a chat completion request for the next submit()"""
+        self._queued.append((custom_id, messages))
+    
+    def submit(self) -> str:
+        """Upload the queued requests as a JSONL file, start a batch job and return its ID"""
+        # The queue is emptied even if the upload fails, so a retry never resubmits stale custom_ids
+        queued = self._queued
+        try:
+            return self._submit(queued)
+        finally:
+            self._queued = []
+    
+    def _submit(self, queued: list) -> str:
+        lines = [
+            _json_dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": self.model, "messages": messages, "max_tokens": 1000, "temperature": 0.3}
+            })
+            for custom_id, messages in queued
+        ]
+        
+        upload = self.session.post(
+            f"{self.base_url}/files",
+            data={"purpose": "batch"},
+            files={"file": ("batch.jsonl", "\n".join(lines).encode(), "application/jsonl")},
+            timeout=60
+        )
+        upload.raise_for_status()
+        
+        batch = self.session.post(f"{self.base_url}/batches", json={
+            "input_file_id": upload.json()["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": self.completion_window
+        }, timeout=30)
+        batch.raise_for_status()
+        return batch.json()["id"]
+    
+    def wait(self, batch_id: str, timeout: float = None) -> Dict[str, str]:
+        """Poll until the batch finishes and return response text keyed by custom_id.
+        
+        Raises TimeoutError (after asking the provider to cancel the job) if it is still running
+        after timeout seconds, max_wait by default.
+        """
+        deadline = time.monotonic() + (self.max_wait if timeout is None else timeout)
+        while True:
+            status = self.session.get(f"{self.base_url}/batches/{batch_id}", timeout=30)
+            status.raise_for_status()
+            batch = status.json()
+            if batch["status"] in ("completed", "failed", "expired", "cancelled"):
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._cancel(batch_id)
+                raise TimeoutError(f"Batch {batch_id} still {batch['status']} after waiting for it")
+            time.sleep(min(self.poll_interval, remaining))
+        
+        if not batch.get("output_file_id"):
+            logger.error(f"Batch {batch_id} ended with status {batch['status']}")
+            return {}
+        
+        output = self.session.get(f"{self.base_url}/files/{batch['output_file_id']}/content", timeout=60)
+        output.raise_for_status()
+        
+        responses = {}
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            record = _json_loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                responses[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return responses
+    
+    def _cancel(self, batch_id: str):
+        """Best-effort cancellation of a batch that is no longer being waited for"""
+        try:
+            self.session.post(f"{self.base_url}/batches/{batch_id}/cancel", timeout=30)
+        except requests.RequestException as e:
+            logger.warning(f"Could not cancel batch {batch_id}: {e}")
 
 class ClassifierAgent:
     """Central classifier that routes inputs to appropriate agents"""
     
-    def __init__(self, llm_client: LLMClient, shared_memory: SharedMemory):
-        self.llm_client = llm_client
-        self.shared_memory = shared_memory
+    INTENTS = ("Invoice", "RFQ", "Complaint", "Regulation", "General")
     
-    def classify(self, content: str, filename: str = "", thread_id: str = None) -> Dict[str, str]:
-        """Classify input format and intent"""
-        format_type = self._detect_format(content, filename)
-        intent_prompt = f"""
-        Analyze the following content and classify its intent. Choose from:
+    INTENT_TAXONOMY = """
         - Invoice: Bills, payment requests, receipts
-        - RFQ: Request for Quote, procurement requests  
+        - RFQ: Request for Quote, procurement requests
         - Complaint: Customer complaints, issues, feedback
         - Regulation: Legal documents, compliance, policies
         - General: Other business communications
+    """
+    
+    # A five-way label needs only a small model; answers that name no intent are retried on the larger one
+    CLASSIFIER_MODEL = "meta-llama/llama-3.2-1b-instruct:free"
+    ESCALATION_MODEL = "meta-llama/llama-3.1-8b-instruct:free"
+    
+    # Static instructions go first as a system message so providers can serve them from prompt cache
+    SYSTEM_PROMPT = f"""
+        Analyze the content provided by the user and classify its intent. Choose from:
+        {INTENT_TAXONOMY}
+        Respond with only the intent category (Invoice/RFQ/Complaint/Regulation/General).
+    """
+    
+    # Keyword rules that settle the intent without an LLM call when they agree strongly enough
+    INTENT_RULES = (
+        ("Invoice", re.compile(r'\b(invoice|bill\s*to|amount\s*due|subtotal|payment\s*terms)\b', re.I)),
+        ("RFQ", re.compile(r'\b(rfq|request\s*for\s*(?:a\s*)?quot(?:e|ation)|quotation|bid\s*deadline)\b', re.I)),
+        ("Complaint", re.compile(r'\b(complaint|refund|defective|dissatisfied|unacceptable|damaged)\b', re.I)),
+        ("Regulation", re.compile(r'\b(regulation|compliance|gdpr|directive|statute|hipaa)\b', re.I)),
+    )
+    
+    JSON_INTENT_KEYS = {
+        "invoice_number": "Invoice",
+        "rfq_number": "RFQ",
+        "complaint_id": "Complaint"
+    }
+    
+    RULE_MIN_HITS = 2
+    
+    EXT_MAP = {
+        ".pdf": "PDF",
+        ".json": "JSON",
+        ".eml": "Email",
+        ".msg": "Email"
+    }
+    
+    # Header lines at the start of a line, allowing the indentation of pasted or triple-quoted mail
+    EMAIL_HINT_RE = re.compile(r'^[ \t]*(?:From|To|Subject|Date):', re.M)
+    
+    AGENT_MAPPING = {
+        "JSON": "json_agent",
+        "Email": "email_agent",
+        "PDF": "pdf_agent",
+        "Text": "email_agent"
+    }
+    
+    def __init__(self, llm_client: LLMClient, shared_memory: SharedMemory):
+        self.llm_client = llm_client
+        self.shared_memory = shared_memory
+    
+    def precheck(self, content: str, filename: str = "") -> Tuple[str, Optional[str]]:
+        """Format and rule-based intent (None without a rule hit), the LLM-free part of classify"""
+        format_type = self.detect_format(content, filename)
+        return format_type, self._rule_classify(content, format_type)
+    
+    def classify(self, content: str, filename: str = "", thread_id: str = None,
+                 now_iso: str = None, prechecked: Tuple[str, Optional[str]] = None) -> Dict[str, str]:
+        """Classify input format and intent, reusing a precheck() result when the caller has one"""
+        format_type, intent = prechecked or self.precheck(content, filename)
         
-        Content preview: {content[:500]}...
+        if intent:
+            classification = self.build_classification(format_type, intent, content)
+            classification["confidence"] = "rule_high"
+            self.log_classification(classification, thread_id, now_iso)
+            return classification
         
-        Respond with only the intent category (Invoice/RFQ/Complaint/Regulation/General):
-        """
+        messages = [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": f"Content preview: {self._canonical_preview(content)}..."}
+        ]
+        response = self.llm_client.call(messages, model=self.CLASSIFIER_MODEL)
+        intent = self.normalize_intent(response)
+        if intent is None:
+            response = self.llm_client.call(messages, model=self.ESCALATION_MODEL)
+            intent = self.normalize_intent(response) or response.strip()
+        
+        classification = self.build_classification(format_type, intent, content)
+        self.log_classification(classification, thread_id, now_iso)
         
-        messages = [{"role": "user", "content": intent_prompt}]
-        intent = self.llm_client.call(messages).strip()
+        return classification
+    
+    def _rule_classify(self, content: str, format_type: str) -> Optional[str]:
+        """Intent from keyword rules alone, or None when they are absent or ambiguous"""
+        if format_type == "JSON":
+            try:
+                data = _json_loads(content)
+            except ValueError:
+                data = None
+            if isinstance(data, dict):
+                for key, intent in self.JSON_INTENT_KEYS.items():
+                    if key in data:
+                        return intent
+                document_type = str(data.get("document_type", "")).lower()
+                for intent in self.INTENTS:
+                    if document_type == intent.lower():
+                        return intent
         
-        classification = {
+        window = content[:5000]
+        scores = {}
+        for intent, pattern in self.INTENT_RULES:
+            hits = {" ".join(match.lower().split()) for match in pattern.findall(window)}
+            if len(hits) >= self.RULE_MIN_HITS:
+                scores[intent] = len(hits)
+        
+        if not scores:
+            return None
+        ranked = sorted(scores.values(), reverse=True)
+        if len(ranked) > 1 and ranked[0] == ranked[1]:
+            return None
+        return max(scores, key=scores.get)
+    
+    def _canonical_preview(self, content: str) -> str:
+        """Whitespace-collapsed classification window, so near-identical documents share a cache entry"""
+        return " ".join(content[:500].split())
+    
+    def build_classification(self, format_type: str, intent: str, content: str) -> Dict[str, str]:
+        """Assemble the classification record shared by every routing path"""
+        return {
             "format": format_type,
             "intent": intent,
             "confidence": "high" if len(content) > 100 else "medium"
         }
+    
+    def log_classification(self, classification: Dict[str, str], thread_id: str = None,
+                            now_iso: str = None):
+        """Record a classification in shared memory"""
         if thread_id:
             self.shared_memory.log_processing(ProcessingResult(
                 success=True,
                 data={"classification": classification},
                 agent_type="classifier",
                 classification=classification,
-                timestamp=datetime.datetime.now().isoformat(),
+                timestamp=now_iso or _utc_now_iso(),
                 thread_id=thread_id
             ))
-        
-        return classification
     
-    def _detect_format(self, content: str, filename: str) -> str:
+    def normalize_intent(self, response: str) -> Optional[str]:
+        """Map an LLM intent answer onto one of INTENTS, or None if it names none of them"""
+        response = response.strip().lower()
+        for intent in self.INTENTS:
+            if response.startswith(intent.lower()):
+                return intent
+        return None
+    
+    def detect_format(self, content: str, filename: str) -> str:
         """Detect input format"""
-        filename = filename.lower()
+        format_type = self.EXT_MAP.get(Path(filename).suffix.lower())
+        if format_type:
+            return format_type
         
-        if filename.endswith('.pdf') or 'PDF' in content[:100]:
+        if content.startswith('%PDF'):
             return "PDF"
-        elif filename.endswith('.json') or content.strip().startswith('{'):
+        elif content.lstrip()[:1] == '{':
             return "JSON"
-        elif 'From:' in content or 'Subject:' in content or '@' in content:
+        elif self.EMAIL_HINT_RE.search(content, 0, 500):
             return "Email"
         else:
             return "Text"
     
-    def route(self, content: str, filename: str = "", thread_id: str = None) -> Tuple[str, Dict]:
+    def route(self, content: str, filename: str = "", thread_id: str = None,
+              now_iso: str = None, prechecked: Tuple[str, Optional[str]] = None) -> Tuple[str, Dict]:
         """Classify and route to appropriate agent"""
-        classification = self.classify(content, filename, thread_id)
+        classification = self.classify(content, filename, thread_id, now_iso, prechecked)
         
-        agent_mapping = {
-            "JSON": "json_agent",
-            "Email": "email_agent", 
-            "PDF": "pdf_agent",
-            "Text": "email_agent"
-        }
-        
-        target_agent = agent_mapping.get(classification["format"], "email_agent")
-        
-        return target_agent, classification
+        return self.target_agent(classification["format"]), classification
+    
+    def target_agent(self, format_type: str) -> str:
+        """Name of the agent that handles a given input format"""
+        return self.AGENT_MAPPING.get(format_type, "email_agent")
 
 class JSONAgent:
     """Agent for processing JSON payloads"""
     
+    SCHEMAS = {
+        "Invoice": {
+            "required": ["invoice_number", "amount", "date", "vendor"],
+            "optional": ["due_date", "items", "tax_amount"]
+        },
+        "RFQ": {
+            "required": ["rfq_number", "items", "deadline", "contact"],
+            "optional": ["specifications", "budget_range"]
+        },
+        "Complaint": {
+            "required": ["issue_type", "description", "severity"],
+            "optional": ["customer_id", "product_id", "date_occurred"]
+        }
+    }
+    
+    DEFAULT_SCHEMA = {
+        "required": ["type", "description"],
+        "optional": ["metadata"]
+    }
+    
+    # Shapes of the accepted date formats; each named group maps to the strptime formats to confirm it
+    DATE_RE = re.compile(
+        # \s+ because the space in a strptime format matches any run of whitespace
+        r'(?P<datetime>\d{4}-\d{1,2}-\d{1,2}\s+\d{1,2}:\d{1,2}:\d{1,2})'
+        r'|(?P<date>\d{4}-\d{1,2}-\d{1,2})'
+        r'|(?P<slashed>\d{1,2}/\d{1,2}/\d{4})'
+    )
+    
+    DATE_FORMATS = {
+        "datetime": ('%Y-%m-%d %H:%M:%S',),
+        "date": ('%Y-%m-%d',),
+        "slashed": ('%m/%d/%Y', '%d/%m/%Y')
+    }
+    
+    AMOUNT_STRIP_RE = re.compile(r'[$,]')
+    
+    # Other key names a schema field is commonly stored under, to pick prompt-relevant keys
+    FIELD_SYNONYMS = {
+        "invoice_number": ("invoice_id", "inv_no", "invoice"),
+        "rfq_number": ("rfq_id", "rfq", "request_id"),
+        "amount": ("total", "price", "cost", "sum"),
+        "vendor": ("supplier", "seller", "company", "from"),
+        "date": ("issued", "created"),
+        "deadline": ("due", "close", "expires"),
+        "contact": ("email", "phone", "requester", "buyer"),
+        "issue_type": ("category", "problem", "type"),
+        "description": ("details", "summary", "notes", "message"),
+        "severity": ("priority", "urgency", "impact"),
+        "type": ("kind", "category")
+    }
+    
+    # About 1500 tokens of source data per extraction prompt
+    MAX_SOURCE_CHARS = 6000
+    
     def __init__(self, llm_client: LLMClient, shared_memory: SharedMemory):
         self.llm_client = llm_client
         self.shared_memory = shared_memory
+        self._system_prompts = {}
     
-    def process(self, content: str, classification: Dict, thread_id: str) -> ProcessingResult:
-        """Process JSON input"""
+    def process(self, content: str, classification: Dict, thread_id: str,
+                extracted: Dict = None, now_iso: str = None) -> ProcessingResult:
+        """Process JSON input, extracting fields unless they were already extracted upstream"""
+        now_iso = now_iso or _utc_now_iso()
         try:
-            data = json.loads(content)
+            data = _json_loads(content)
             
             target_schema = self._get_target_schema(classification["intent"])
-            extracted = self._extract_to_schema(data, target_schema)
+            if extracted is None:
+                extracted = self._extract_to_schema(data, target_schema)
             anomalies = self._detect_anomalies(extracted, target_schema)
             
             result_data = {
@@ -283,18 +834,15 @@ class JSONAgent:
                 "anomalies": anomalies,
                 "schema_compliance": len(anomalies) == 0
             }
-            self.shared_memory.update_context(
-                thread_id=thread_id,
-                extracted_fields=extracted
-            )
             
             return ProcessingResult(
                 success=True,
                 data=result_data,
                 agent_type="json_agent",
                 classification=classification,
-                timestamp=datetime.datetime.now().isoformat(),
-                thread_id=thread_id
+                timestamp=now_iso,
+                thread_id=thread_id,
+                context={"extracted_fields": extracted}
             )
             
         except json.JSONDecodeError as e:
@@ -303,7 +851,7 @@ class JSONAgent:
                 data={},
                 agent_type="json_agent", 
                 classification=classification,
-                timestamp=datetime.datetime.now().isoformat(),
+                timestamp=now_iso,
                 thread_id=thread_id,
                 errors=[f"JSON parsing error: {str(e)}"]
             )
@@ -313,62 +861,138 @@ class JSONAgent:
                 data={},
                 agent_type="json_agent",
                 classification=classification, 
-                timestamp=datetime.datetime.now().isoformat(),
+                timestamp=now_iso,
                 thread_id=thread_id,
                 errors=[f"Processing error: {str(e)}"]
             )
     
     def _get_target_schema(self, intent: str) -> Dict:
         """Get target schema based on intent"""
-        schemas = {
-            "Invoice": {
-                "required": ["invoice_number", "amount", "date", "vendor"],
-                "optional": ["due_date", "items", "tax_amount"]
-            },
-            "RFQ": {
-                "required": ["rfq_number", "items", "deadline", "contact"],
-                "optional": ["specifications", "budget_range"]
-            },
-            "Complaint": {
-                "required": ["issue_type", "description", "severity"],
-                "optional": ["customer_id", "product_id", "date_occurred"]
-            }
-        }
-        return schemas.get(intent, {
-            "required": ["type", "description"],
-            "optional": ["metadata"]
-        })
+        return self.SCHEMAS.get(intent, self.DEFAULT_SCHEMA)
     
     def _extract_to_schema(self, data: Dict, schema: Dict) -> Dict:
-        """Extract data according to target schema"""
-        extracted = {}
-        prompt = f"""
-        Extract the following fields from this JSON data:
-        Required fields: {schema.get('required', [])}
-        Optional fields: {schema.get('optional', [])}
+        """Extract data according to target schema, asking the LLM only for what the keys do not cover"""
+        if not isinstance(data, dict):
+            return self._extract_with_llm(data, schema)
         
-        Source data: {json.dumps(data, indent=2)}
+        extracted = self._match_fields(data, schema.get('required', []) + schema.get('optional', []))
         
-        Return a JSON object with the extracted fields. If a required field is missing, set it to null.
-        """
+        missing = [field for field in schema.get('required', []) if extracted.get(field) is None]
+        if missing and self._has_free_text(data):
+            found = self._extract_with_llm(data, {"required": missing, "optional": []})
+            extracted.update({field: found[field] for field in missing if found.get(field) is not None})
         
-        messages = [{"role": "user", "content": prompt}]
-        response = self.llm_client.call(messages)
+        return extracted
+    
+    def _match_fields(self, data: Dict, fields: list) -> Dict:
+        """Map schema fields onto source keys: exact, case-insensitive, substring, then FIELD_SYNONYMS match"""
+        key_index = {key.lower(): key for key in data}
+        extracted = {}
+        for field in fields:
+            field_lower = field.lower()
+            key = field if field in data else key_index.get(field_lower) or next(
+                (key for key_lower, key in key_index.items()
+                 if field_lower in key_lower or key_lower in field_lower),
+                None
+            )
+            if key is None:
+                # Synonyms match whole keys only; short ones like "from" would be too loose as substrings
+                key = next((key_index[synonym] for synonym in self.FIELD_SYNONYMS.get(field, ())
+                            if synonym in key_index), None)
+            if key is not None:
+                extracted[field] = data[key]
+        return extracted
+    
+    def _has_free_text(self, value: Any) -> bool:
+        """Whether the data holds prose that the LLM could mine for fields the keys do not name"""
+        if isinstance(value, str):
+            return len(value.split()) >= 4
+        if isinstance(value, dict):
+            return any(self._has_free_text(item) for item in value.values())
+        if isinstance(value, list):
+            return any(self._has_free_text(item) for item in value)
+        return False
+    
+    def _extract_with_llm(self, data: Any, schema: Dict) -> Dict:
+        """Ask the LLM for the schema fields; empty if the reply is not a JSON object"""
+        messages = [
+            {"role": "system", "content": self._system_prompt(schema)},
+            {"role": "user", "content": f"Source data: {self._source_view(data, schema)}"}
+        ]
+        return _parse_json_object(self.llm_client.call(messages)) or {}
+    
+    def _source_view(self, data: Any, schema: Dict) -> str:
+        """Compact, capped JSON of the flattened keys relevant to the schema plus any free text"""
+        terms = set()
+        for field in schema.get('required', []) + schema.get('optional', []):
+            terms.add(field.lower())
+            terms.update(self.FIELD_SYNONYMS.get(field, ()))
         
-        try:
-            extracted = json.loads(response)
-        except:
-            all_fields = schema.get('required', []) + schema.get('optional', [])
-            for field in all_fields:
-                if field in data:
-                    extracted[field] = data[field]
-                else:
-                    for key in data.keys():
-                        if field.lower() in key.lower() or key.lower() in field.lower():
-                            extracted[field] = data[key]
-                            break
+        flat = self._flatten(data)
+        matched = [(path, value) for path, value in flat.items() if any(term in path.lower() for term in terms)]
+        matched_paths = {path for path, _ in matched}
+        free_text = [
+            (path, value) for path, value in flat.items()
+            if path not in matched_paths and self._has_free_text(value)
+        ]
+        # Schema-matched paths first so free text cannot crowd them out of the budget
+        candidates = matched + free_text or list(flat.items())
         
-        return extracted
+        parts = []
+        size = 2
+        for path, value in candidates:
+            key = json.dumps(path, ensure_ascii=False)
+            part = f"{key}:{json.dumps(value, ensure_ascii=False, default=str)}"
+            remaining = self.MAX_SOURCE_CHARS - size - 1
+            if len(part) > remaining:
+                # Oversized strings are clipped to the remaining budget; other oversized values are skipped
+                if not isinstance(value, str):
+                    continue
+                part = self._clipped_part(key, value, remaining)
+                if part is None:
+                    continue
+            size += len(part) + 1
+            parts.append(part)
+        return "{" + ",".join(parts) + "}"
+    
+    def _clipped_part(self, key: str, value: str, budget: int) -> Optional[str]:
+        """key:value pair with the string value cut so the encoded pair fits in budget, or None if nothing fits"""
+        keep = budget - len(key) - 3
+        while keep > 0:
+            part = f"{key}:{json.dumps(value[:keep], ensure_ascii=False)}"
+            if len(part) <= budget:
+                return part
+            keep -= len(part) - budget
+        return None
+    
+    def _flatten(self, value: Any, prefix: str = "") -> Dict:
+        """Flatten nested objects and lists into dotted-path keys"""
+        if isinstance(value, dict):
+            items = value.items()
+        elif isinstance(value, list):
+            items = enumerate(value)
+        else:
+            return {prefix or "value": value}
+        
+        flat = {}
+        for key, item in items:
+            flat.update(self._flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    
+    def _system_prompt(self, schema: Dict) -> str:
+        """Static extraction instructions for a schema, built once per schema"""
+        required, optional = schema.get('required', []), schema.get('optional', [])
+        key = (tuple(required), tuple(optional))
+        prompt = self._system_prompts.get(key)
+        if prompt is None:
+            prompt = self._system_prompts[key] = f"""
+        Extract the following fields from the JSON data provided by the user:
+        Required fields: {required}
+        Optional fields: {optional}
+        
+        Return a JSON object with the extracted fields. If a required field is missing, set it to null.
+        """
+        return prompt
     
     def _detect_anomalies(self, extracted: Dict, schema: Dict) -> list:
         """Detect anomalies or missing required fields"""
@@ -377,13 +1001,14 @@ class JSONAgent:
             if field not in extracted or extracted[field] is None:
                 anomalies.append(f"Missing required field: {field}")
         for field, value in extracted.items():
-            if 'amount' in field.lower() or 'price' in field.lower():
+            is_amount, is_date = _field_checks(field)
+            if is_amount:
                 try:
-                    float(str(value).replace('$', '').replace(',', ''))
-                except:
+                    float(self.AMOUNT_STRIP_RE.sub('', str(value)))
+                except ValueError:
                     anomalies.append(f"Invalid numeric format for {field}: {value}")
             
-            if 'date' in field.lower():
+            if is_date:
                 if not self._is_valid_date(str(value)):
                     anomalies.append(f"Invalid date format for {field}: {value}")
         
@@ -391,29 +1016,65 @@ class JSONAgent:
     
     def _is_valid_date(self, date_str: str) -> bool:
         """Check if string is a valid date"""
-        date_formats = ['%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S']
-        for fmt in date_formats:
+        match = self.DATE_RE.fullmatch(date_str)
+        if not match:
+            return False
+        # The shape picks the format; strptime only confirms the values (e.g. no month 13)
+        for fmt in self.DATE_FORMATS[match.lastgroup]:
             try:
                 datetime.datetime.strptime(date_str, fmt)
                 return True
-            except:
+            except ValueError:
                 continue
         return False
 
 class EmailAgent:
     """Agent for processing email content"""
     
+    EXTRACTION_TEMPLATE = """{
+            "sender": "sender name and email",
+            "sender_company": "company name if mentioned",
+            "subject": "email subject",
+            "key_points": ["list of main points"],
+            "action_items": ["specific actions requested"],
+            "entities": ["people, companies, products mentioned"],
+            "sentiment": "positive/negative/neutral",
+            "intent_specific": {
+                // Intent-specific fields based on classification
+            }
+        }"""
+    
+    # Searched in order, first hit wins: a higher level beats any lower one anywhere in the body
+    URGENCY_LEVELS = (
+        ("high", re.compile(r'urgent|asap|immediately|emergency|critical|deadline', re.I)),
+        ("medium", re.compile(r'soon|priority|important|needed|required', re.I)),
+        ("low", re.compile(r'when possible|no rush|fyi|update', re.I)),
+    )
+    
+    SYSTEM_PROMPT = f"""
+        Extract key information from the email provided by the user, taking its classification into account.
+        
+        Extract the following information and return as JSON:
+        {EXTRACTION_TEMPLATE}
+        """
+    
     def __init__(self, llm_client: LLMClient, shared_memory: SharedMemory):
         self.llm_client = llm_client
         self.shared_memory = shared_memory
+        # Parsers hold no per-message state, so one of each serves every email
+        self._header_parser = HeaderParser(policy=default)
+        self._parser = Parser(policy=default)
     
-    def process(self, content: str, classification: Dict, thread_id: str) -> ProcessingResult:
-        """Process email input"""
+    def process(self, content: str, classification: Dict, thread_id: str,
+                extracted: Dict = None, now_iso: str = None) -> ProcessingResult:
+        """Process email input, extracting fields unless they were already extracted upstream"""
+        now_iso = now_iso or _utc_now_iso()
         try:
             email_data = self._parse_email(content)
-            extracted = self._extract_email_info(email_data, classification)
+            if extracted is None:
+                extracted = self._extract_email_info(email_data, classification)
             urgency = self._assess_urgency(email_data["body"])
-            crm_formatted = self._format_for_crm(extracted, urgency)
+            crm_formatted = self._format_for_crm(extracted, urgency, now_iso)
             
             result_data = {
                 "email_structure": email_data,
@@ -421,20 +1082,19 @@ class EmailAgent:
                 "urgency_level": urgency,
                 "crm_formatted": crm_formatted
             }
-            self.shared_memory.update_context(
-                thread_id=thread_id,
-                sender=extracted.get("sender", ""),
-                topic=extracted.get("subject", ""),
-                extracted_fields=extracted
-            )
             
             return ProcessingResult(
                 success=True,
                 data=result_data,
                 agent_type="email_agent",
                 classification=classification,
-                timestamp=datetime.datetime.now().isoformat(),
-                thread_id=thread_id
+                timestamp=now_iso,
+                thread_id=thread_id,
+                context={
+                    "sender": extracted.get("sender", ""),
+                    "topic": extracted.get("subject", ""),
+                    "extracted_fields": extracted
+                }
             )
             
         except Exception as e:
@@ -443,7 +1103,7 @@ class EmailAgent:
                 data={},
                 agent_type="email_agent",
                 classification=classification,
-                timestamp=datetime.datetime.now().isoformat(),
+                timestamp=now_iso,
                 thread_id=thread_id,
                 errors=[f"Email processing error: {str(e)}"]
             )
@@ -451,7 +1111,10 @@ class EmailAgent:
     def _parse_email(self, content: str) -> Dict:
         """Parse email structure"""
         try:
-            msg = Parser(policy=default).parsestr(content)
+            # Single-part bodies are taken verbatim after the headers; only multipart needs the MIME tree
+            msg = self._header_parser.parsestr(content)
+            if msg.get_content_maintype() == "multipart":
+                msg = self._parser.parsestr(content)
             
             return {
                 "from": msg.get("From", ""),
@@ -485,33 +1148,22 @@ class EmailAgent:
     def _extract_email_info(self, email_data: Dict, classification: Dict) -> Dict:
         """Extract key information using LLM"""
         
-        prompt = f"""
-        Extract key information from this email based on its classification as "{classification['intent']}":
+        email_text = f"""
+        Classification: "{classification['intent']}"
         
         From: {email_data['from']}
         Subject: {email_data['subject']}
         Body: {email_data['body'][:1000]}...
-        
-        Extract the following information and return as JSON:
-        {{
-            "sender": "sender name and email",
-            "sender_company": "company name if mentioned",
-            "subject": "email subject",
-            "key_points": ["list of main points"],
-            "action_items": ["specific actions requested"],
-            "entities": ["people, companies, products mentioned"],
-            "sentiment": "positive/negative/neutral",
-            "intent_specific": {{
-                // Intent-specific fields based on classification
-            }}
-        }}
         """
         
-        messages = [{"role": "user", "content": prompt}]
+        messages = [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": email_text}
+        ]
         response = self.llm_client.call(messages)
         
         try:
-            extracted = json.loads(response)
+            extracted = _json_loads(response)
         except:
             extracted = {
                 "sender": email_data["from"],
@@ -526,21 +1178,13 @@ class EmailAgent:
     
     def _assess_urgency(self, body: str) -> str:
         """Assess email urgency"""
-        urgency_keywords = {
-            "high": ["urgent", "asap", "immediately", "emergency", "critical", "deadline"],
-            "medium": ["soon", "priority", "important", "needed", "required"],
-            "low": ["when possible", "no rush", "fyi", "update"]
-        }
-        
-        body_lower = body.lower()
-        
-        for level, keywords in urgency_keywords.items():
-            if any(keyword in body_lower for keyword in keywords):
+        for level, pattern in self.URGENCY_LEVELS:
+            if pattern.search(body):
                 return level
         
         return "medium"
     
-    def _format_for_crm(self, extracted: Dict, urgency: str) -> Dict:
+    def _format_for_crm(self, extracted: Dict, urgency: str, now_iso: str = None) -> Dict:
         """Format extracted data for CRM system"""
         return {
             "contact_name": extracted.get("sender", ""),
@@ -550,16 +1194,20 @@ class EmailAgent:
             "category": extracted.get("sentiment", "neutral"),
             "summary": " | ".join(extracted.get("key_points", [])),
             "next_actions": extracted.get("action_items", []),
-            "created_date": datetime.datetime.now().isoformat(),
+            "created_date": now_iso or _utc_now_iso(),
             "status": "new"
         }
 
 class MultiAgentSystem:
     """Main orchestrator for the multi-agent system"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, batch_client: BatchLLMClient = None, batch_threshold: int = 20):
+        self.batch_client = batch_client
+        self.batch_threshold = batch_threshold
+        self._pending_batches = {}
+        self._combined_prompts = {}
         self.shared_memory = SharedMemory()
-        self.llm_client = LLMClient(api_key)
+        self.llm_client = LLMClient(api_key, cache=self.shared_memory)
         self.classifier = ClassifierAgent(self.llm_client, self.shared_memory)
         self.json_agent = JSONAgent(self.llm_client, self.shared_memory)
         self.email_agent = EmailAgent(self.llm_client, self.shared_memory)
@@ -573,109 +1221,338 @@ class MultiAgentSystem:
     def process_input(self, content: str, filename: str = "", thread_id: str = None) -> ProcessingResult:
         """Main processing pipeline"""
         
+        # One timestamp per document, shared by every row and result it produces
+        now_iso = _utc_now_iso()
         if not thread_id:
             thread_id = f"thread_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
         logger.info(f"Processing input - Thread: {thread_id}, File: {filename}")
         
         try:
-            target_agent, classification = self.classifier.route(content, filename, thread_id)
-            
-            logger.info(f"Classified as {classification['format']} with intent {classification['intent']}")
-            logger.info(f"Routing to {target_agent}")
-            agent = self.agents[target_agent]
-            result = agent.process(content, classification, thread_id)
-            self.shared_memory.log_processing(result)
-            
-            logger.info(f"Processing {'completed' if result.success else 'failed'}")
-            
-            return result
+            # Format detection and the keyword rules run once and are shared with the classifier
+            prechecked = self.classifier.precheck(content, filename)
+            combined = self._classify_and_extract(content, prechecked)
+            return self._route_and_process(content, filename, thread_id, combined, now_iso, prechecked)
             
         except Exception as e:
-            logger.error(f"System error: {e}")
-            return ProcessingResult(
-                success=False,
-                data={},
-                agent_type="system",
-                classification={"format": "unknown", "intent": "unknown"},
-                timestamp=datetime.datetime.now().isoformat(),
-                thread_id=thread_id,
-                errors=[f"System error: {str(e)}"]
+            return self._system_error(e, thread_id, now_iso)
+    
+    def _route_and_process(self, content: str, filename: str, thread_id: str,
+                           combined: Optional[Tuple[Dict, Dict]], now_iso: str,
+                           prechecked: Tuple[str, Optional[str]] = None) -> ProcessingResult:
+        """Run the target agent, using combined (classification, extracted) output when available"""
+        if combined:
+            classification, extracted = combined
+            target_agent = self.classifier.target_agent(classification["format"])
+            self.classifier.log_classification(classification, thread_id, now_iso)
+        else:
+            # Fall back to a separate classification call plus per-agent extraction
+            target_agent, classification = self.classifier.route(content, filename, thread_id, now_iso, prechecked)
+            extracted = None
+        
+        logger.info(f"Classified as {classification['format']} with intent {classification['intent']}")
+        logger.info(f"Routing to {target_agent}")
+        agent = self.agents[target_agent]
+        result = agent.process(content, classification, thread_id, extracted=extracted, now_iso=now_iso)
+        # The agent's thread context is stored in the same transaction as its log row
+        self.shared_memory.log_and_update(result)
+        
+        logger.info(f"Processing {'completed' if result.success else 'failed'}")
+        
+        return result
+    
+    def _system_error(self, error: Exception, thread_id: str, now_iso: str = None) -> ProcessingResult:
+        """Build the result returned when the pipeline itself fails"""
+        logger.error(f"System error: {error}")
+        return ProcessingResult(
+            success=False,
+            data={},
+            agent_type="system",
+            classification={"format": "unknown", "intent": "unknown"},
+            timestamp=now_iso or _utc_now_iso(),
+            thread_id=thread_id,
+            errors=[f"System error: {str(error)}"]
+        )
+    
+    async def process_inputs(self, items: list, concurrency_limit: int = 8, thread_ids: list = None) -> list:
+        """Process (content, filename) pairs concurrently; results come back in input order"""
+        sem = asyncio.Semaphore(concurrency_limit)
+        # The default thread ID only has per-second resolution, so number each item
+        thread_ids = thread_ids or self._batch_thread_ids(len(items))
+        
+        async def run(content, filename, thread_id):
+            async with sem:
+                return await asyncio.to_thread(self.process_input, content, filename, thread_id)
+        
+        return await asyncio.gather(*(run(content, filename, thread_id)
+                                      for (content, filename), thread_id in zip(items, thread_ids)))
+    
+    def process_batch(self, items: list, concurrency_limit: int = 8, thread_ids: list = None) -> list:
+        """Blocking wrapper around process_inputs"""
+        return asyncio.run(self.process_inputs(items, concurrency_limit, thread_ids))
+    
+    def _batch_thread_ids(self, count: int) -> list:
+        """Numbered thread IDs for one batch, since the default ID only has per-second resolution"""
+        batch_stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        return [f"batch_{batch_stamp}_{i}" for i in range(count)]
+    
+    def process_batch_async(self, items: list, thread_ids: list = None) -> str:
+        """Submit (content, filename) pairs as one provider batch job and return its batch ID"""
+        if self.batch_client is None:
+            raise ValueError("No batch client configured: pass batch_client to MultiAgentSystem")
+        thread_ids = thread_ids or self._batch_thread_ids(len(items))
+        pending = []
+        for i, ((content, filename), thread_id) in enumerate(zip(items, thread_ids)):
+            prechecked = self.classifier.precheck(content, filename)
+            custom_id = None
+            # Same split as the real-time path: JSON and rule-decided items are handled locally
+            if self._needs_combined_call(prechecked):
+                custom_id = f"item_{i}"
+                self.batch_client.add(custom_id, self._combined_messages(content, prechecked[0]))
+            pending.append((content, filename, thread_id, prechecked, custom_id))
+        
+        if any(item[4] for item in pending):
+            batch_id = self.batch_client.submit()
+        else:
+            # Nothing needs the provider; collect_batch processes every item locally
+            batch_id = f"local_{id(pending)}"
+        self._pending_batches[batch_id] = pending
+        return batch_id
+    
+    def collect_batch(self, batch_id: str) -> list:
+        """Wait for a submitted batch and finish processing each document, in submission order"""
+        pending = self._pending_batches.pop(batch_id)
+        responses = self.batch_client.wait(batch_id) if any(item[4] for item in pending) else {}
+        
+        results = []
+        for content, filename, thread_id, prechecked, custom_id in pending:
+            response = responses.get(custom_id) if custom_id else None
+            now_iso = _utc_now_iso()
+            try:
+                combined = self._parse_combined(response, prechecked[0], content) if response else None
+                results.append(self._route_and_process(content, filename, thread_id, combined, now_iso,
+                                                       prechecked))
+            except Exception as e:
+                results.append(self._system_error(e, thread_id, now_iso))
+        return results
+    
+    async def process_file_async(self, file_path: str, thread_id: str = None) -> ProcessingResult:
+        """Process a file in a worker thread so reads and PDF parsing stay off the event loop"""
+        return await asyncio.to_thread(self.process_file, file_path, thread_id)
+    
+    async def process_files_async(self, file_paths: list, concurrency_limit: int = 8) -> list:
+        """Read, parse and process files concurrently; results come back in input order"""
+        sem = asyncio.Semaphore(concurrency_limit)
+        
+        async def run(file_path, thread_id):
+            async with sem:
+                return await self.process_file_async(file_path, thread_id)
+        
+        return await asyncio.gather(*(run(file_path, thread_id) for file_path, thread_id
+                                      in zip(file_paths, self._batch_thread_ids(len(file_paths)))))
+    
+    def process_files(self, file_paths: list) -> list:
+        """Process several files, through the provider Batch API when configured and the job is large"""
+        if not (self.batch_client and len(file_paths) > self.batch_threshold):
+            return asyncio.run(self.process_files_async(file_paths))
+        
+        # Thread IDs and read errors match the real-time path, so results do not depend on batch_threshold
+        all_thread_ids = self._batch_thread_ids(len(file_paths))
+        results = [None] * len(file_paths)
+        items = []
+        thread_ids = []
+        positions = []
+        for i, content in enumerate(asyncio.run(self._read_files(file_paths))):
+            if isinstance(content, Exception):
+                results[i] = self.read_error_result(Path(file_paths[i]), content, all_thread_ids[i])
+                continue
+            items.append((content, Path(file_paths[i]).name))
+            thread_ids.append(all_thread_ids[i])
+            positions.append(i)
+        
+        try:
+            processed = self.collect_batch(self.process_batch_async(items, thread_ids))
+        except Exception as e:
+            # Covers failed uploads as well as jobs that outlive batch_client.max_wait
+            logger.error(f"Batch processing failed, processing in real time: {e}")
+            processed = self.process_batch(items, thread_ids=thread_ids)
+        
+        for i, result in zip(positions, processed):
+            results[i] = result
+        return results
+    
+    def _classify_and_extract(self, content: str, prechecked: Tuple[str, Optional[str]]) -> Optional[Tuple[Dict, Dict]]:
+        """Classify intent and extract fields in one LLM call; None if the response is unusable"""
+        if not self._needs_combined_call(prechecked):
+            return None
+        format_type = prechecked[0]
+        response = self.llm_client.call(self._combined_messages(content, format_type))
+        return self._parse_combined(response, format_type, content)
+    
+    def _needs_combined_call(self, prechecked: Tuple[str, Optional[str]]) -> bool:
+        """Whether a document should go through the combined classification + extraction prompt"""
+        format_type, rule_intent = prechecked
+        # JSON fields are matched locally and rule hits need no intent call, so a bare
+        # classification plus the agent's own extraction is cheaper than the combined prompt
+        return format_type != "JSON" and not rule_intent
+    
+    def _combined_messages(self, content: str, format_type: str) -> list:
+        """Build the single classification + extraction prompt for a document"""
+        is_json = format_type == "JSON"
+        if is_json:
+            # Compacted and capped like the JSON agent's own source view
+            try:
+                content = _json_dumps(_json_loads(content))
+            except ValueError:
+                pass
+            content = content[:self.json_agent.MAX_SOURCE_CHARS]
+        else:
+            content = content[:1500]
+        return [
+            {"role": "system", "content": self._combined_system_prompt(is_json)},
+            {"role": "user", "content": f"Content: {content}"}
+        ]
+    
+    def _combined_system_prompt(self, is_json: bool) -> str:
+        """Static instructions for the combined prompt; one variant for JSON input, one for the rest"""
+        prompt = self._combined_prompts.get(is_json)
+        if prompt is not None:
+            return prompt
+        
+        if is_json:
+            schema_table = "\n".join(
+                f"        - {intent}: required {schema['required']}, optional {schema['optional']}"
+                for intent, schema in self.json_agent.SCHEMAS.items()
             )
+            default = self.json_agent.DEFAULT_SCHEMA
+            extraction = f"""Then extract the fields of the schema for that intent:
+{schema_table}
+        - Any other intent: required {default['required']}, optional {default['optional']}
+        If a required field is missing, set it to null."""
+        else:
+            extraction = f"""Then extract the following information:
+        {self.email_agent.EXTRACTION_TEMPLATE}"""
+        
+        prompt = self._combined_prompts[is_json] = f"""
+        Analyze the content provided by the user and classify its intent. Choose from:
+        {self.classifier.INTENT_TAXONOMY}
+        {extraction}
+        
+        Respond with only a JSON object of the form {{"intent": "<category>", "extracted": {{...}}}}
+        """
+        return prompt
+    
+    def _parse_combined(self, response: str, format_type: str, content: str) -> Optional[Tuple[Dict, Dict]]:
+        """Split a combined reply into (classification, extracted), or None if it is unusable"""
+        parsed = _parse_json_object(response)
+        if not parsed or not isinstance(parsed.get("extracted"), dict):
+            return None
+        
+        intent = self.classifier.normalize_intent(str(parsed.get("intent", "")))
+        if intent is None:
+            return None
+        
+        classification = self.classifier.build_classification(format_type, intent, content)
+        return classification, parsed["extracted"]
     
     def process_file(self, file_path: str, thread_id: str = None) -> ProcessingResult:
         """Process file input"""
         file_path = Path(file_path)
         
-        if not file_path.exists():
-            return ProcessingResult(
-                success=False,
-                data={},
-                agent_type="system",
-                classification={"format": "unknown", "intent": "unknown"},
-                timestamp=datetime.datetime.now().isoformat(),
-                thread_id=thread_id or "unknown",
-                errors=[f"File not found: {file_path}"]
-            )
         try:
-            if file_path.suffix.lower() == '.pdf':
-                content = self._read_pdf(file_path)
-            elif file_path.suffix.lower() == '.json':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            else:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            
-            return self.process_input(content, file_path.name, thread_id)
-            
+            data = file_path.read_bytes()
+        except Exception as e:
+            return self.read_error_result(file_path, e, thread_id)
+        
+        return self.process_bytes(data, file_path.name, thread_id)
+    
+    def process_bytes(self, data: bytes, filename: str = "", thread_id: str = None) -> ProcessingResult:
+        """Process raw file content, using the filename extension to pick the decoder"""
+        try:
+            content = self._decode(data, filename)
         except Exception as e:
+            return self._file_error(e, thread_id)
+        
+        return self.process_input(content, filename, thread_id)
+    
+    async def _read_files(self, file_paths: list) -> list:
+        """Read and decode files in worker threads; a failed read yields its exception"""
+        def read(file_path):
+            file_path = Path(file_path)
+            return self._decode(file_path.read_bytes(), file_path.name)
+        
+        return await asyncio.gather(*(asyncio.to_thread(read, file_path) for file_path in file_paths),
+                                    return_exceptions=True)
+    
+    def _decode(self, data: bytes, filename: str) -> str:
+        """Turn raw file content into text for the pipeline"""
+        if Path(filename).suffix.lower() == '.pdf':
+            return self._read_pdf(io.BytesIO(data))
+        # Match the newline handling of a text-mode read
+        return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    
+    def read_error_result(self, file_path, error: Exception, thread_id: str = None) -> ProcessingResult:
+        """Failed result for a file that could not be read, as process_file reports it ("File not found" when missing)"""
+        if isinstance(error, FileNotFoundError):
             return ProcessingResult(
                 success=False,
                 data={},
                 agent_type="system",
                 classification={"format": "unknown", "intent": "unknown"},
-                timestamp=datetime.datetime.now().isoformat(),
+                timestamp=_utc_now_iso(),
                 thread_id=thread_id or "unknown",
-                errors=[f"File reading error: {str(e)}"]
+                errors=[f"File not found: {file_path}"]
             )
+        return self._file_error(error, thread_id)
+    
+    def _file_error(self, error: Exception, thread_id: str = None) -> ProcessingResult:
+        """Build the result returned when input content cannot be read"""
+        return ProcessingResult(
+            success=False,
+            data={},
+            agent_type="system",
+            classification={"format": "unknown", "intent": "unknown"},
+            timestamp=_utc_now_iso(),
+            thread_id=thread_id or "unknown",
+            errors=[f"File reading error: {str(error)}"]
+        )
     
-    def _read_pdf(self, file_path: Path) -> str:
-        """Extract text from PDF"""
+    def _read_pdf(self, stream) -> str:
+        """Extract text from a binary PDF stream, using MuPDF when it is installed"""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
+            if pymupdf:
+                with pymupdf.open(stream=stream.read(), filetype="pdf") as doc:
+                    return "".join(page.get_text("text") + "\n" for page in doc)
+            pdf_reader = PyPDF2.PdfReader(stream)
+            return "".join(page.extract_text() + "\n" for page in pdf_reader.pages)
         except Exception as e:
             return f"PDF reading error: {str(e)}"
     
+    def warmup(self):
+        """Run the local (non-LLM) agent steps once so lazily built parsers are cached before real input.
+
+        Covers the email header parser, the urgency scan and the strptime format regexes used by
+        date validation; later documents reuse the cached objects.
+        """
+        sample = "From: warmup@example.com\nSubject: Warmup\nDate: Mon, 15 Jan 2024 10:30:00 +0000\n\nwarmup"
+        self.classifier.precheck(sample, "warmup.eml")
+        email_data = self.email_agent._parse_email(sample)
+        self.email_agent._assess_urgency(email_data["body"])
+        for date_str in ("2024-01-15", "01/15/2024", "2024-01-15 10:30:00"):
+            self.json_agent._is_valid_date(date_str)
+    
     def get_context(self, thread_id: str) -> Dict:
         """Get shared context for a thread"""
         return self.shared_memory.get_context(thread_id)
     
-    def get_processing_history(self, thread_id: str = None) -> list:
-        """Get processing history"""
-        conn = sqlite3.connect(self.shared_memory.db_path)
-        cursor = conn.cursor()
-        
-        if thread_id:
-            cursor.execute('''
-                SELECT * FROM processing_logs WHERE thread_id = ?
-                ORDER BY timestamp DESC
-            ''', (thread_id,))
-        else:
-            cursor.execute('''
-                SELECT * FROM processing_logs 
-                ORDER BY timestamp DESC LIMIT 50
-            ''')
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        return [dict(zip([col[0] for col in cursor.description], row)) for row in results]
+    def get_processing_history(self, thread_id: str = None, limit: Optional[int] = None) -> list:
+        """Get processing history, newest first (last 50 entries unless a thread or limit is given)"""
+        return self.shared_memory.get_processing_history(thread_id, limit)
+    
+    def __del__(self):
+        shared_memory = getattr(self, "shared_memory", None)
+        if shared_memory is not None:
+            shared_memory.close()
 
 def main():
     """Demo function"""
@@ -741,8 +1618,8 @@ def main():
         print(f"CRM Format: {result2.data.get('crm_formatted', {})}")
     print()
     print("3. Processing History:")
-    history = system.get_processing_history()
-    for entry in history[:3]:
+    history = system.get_processing_history(limit=3)
+    for entry in history:
         print(f"  {entry['timestamp']}: {entry['agent_type']} - {entry['source_type']}/{entry['intent']} - {entry['status']}")
     
     print("\n=== Demo Complete ===")
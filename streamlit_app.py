@@ -1,11 +1,16 @@
 import streamlit as st
 import json
+import html
+import hashlib
 import tempfile
 import os
+import shutil
 from datetime import datetime
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-import pandas as pd
 from multiagent_system import MultiAgentSystem, ProcessingResult
+from ui_markup import CSS, HEADER_HTML, FOOTER_HTML, URGENCY_ICONS, AGENT_BADGES
 import logging
 
 # Configure page
@@ -16,133 +21,212 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS for better styling
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 2.5rem;
-        color: #1f77b4;
-        text-align: center;
-        margin-bottom: 2rem;
-    }
-    .agent-badge {
-        padding: 0.25rem 0.75rem;
-        border-radius: 15px;
-        color: white;
-        font-weight: bold;
-        margin: 0.25rem;
-        display: inline-block;
-    }
-    .json-agent { background-color: #ff7f0e; }
-    .email-agent { background-color: #2ca02c; }
-    .pdf-agent { background-color: #d62728; }
-    .classifier { background-color: #9467bd; }
-    
-    .success-box {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        background-color: #d4edda;
-        border: 1px solid #c3e6cb;
-        margin: 1rem 0;
-    }
-    .error-box {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        background-color: #f8d7da;
-        border: 1px solid #f5c6cb;
-        margin: 1rem 0;
-    }
-    .info-box {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        background-color: #d1ecf1;
-        border: 1px solid #bee5eb;
-        margin: 1rem 0;
-    }
-    .result-container {
-        border: 1px solid #dee2e6;
-        border-radius: 0.5rem;
-        padding: 1rem;
-        margin: 1rem 0;
-        background-color: #f8f9fa;
-    }
-</style>
-""", unsafe_allow_html=True)
+st.markdown(CSS, unsafe_allow_html=True)
+
+# Maximum number of full results kept in session state; older ones are evicted least recently used first
+DETAIL_CACHE_SIZE = 200
+# Maximum number of successful results remembered for skipping identical re-submissions
+RESULT_CACHE_SIZE = 128
+
+def new_stats():
+    """Empty running totals; the top agent/intent are tracked on append so tab3 never scans the counters"""
+    return {'total': 0, 'success': 0, 'agent_counts': Counter(), 'intent_counts': Counter(),
+            'top_agent': None, 'top_intent': None}
+
+def bump_count(stats, counter_name, leader_name, value):
+    """Increment one counter and keep its running leader current"""
+    counts = stats[counter_name]
+    counts[value] += 1
+    leader = stats[leader_name]
+    if leader is None or counts[value] > counts[leader]:
+        stats[leader_name] = value
 
 # Initialize session state
-if 'processing_history' not in st.session_state:
-    st.session_state.processing_history = []
+if 'history_summary' not in st.session_state:
+    # Small per-entry rows for tables, filters and stats; full results are looked up by entry_id
+    st.session_state.history_summary = []
+    st.session_state.history_details = OrderedDict()
 if 'api_key' not in st.session_state:
     st.session_state.api_key = ""
 if 'system' not in st.session_state:
     st.session_state.system = None
-if 'show_raw_data' not in st.session_state:
-    st.session_state.show_raw_data = {}
+if 'agent_index' not in st.session_state:
+    # History positions per agent type and per success flag, kept up to date on append
+    st.session_state.agent_index = {}
+    st.session_state.status_index = {True: [], False: []}
+if 'result_cache' not in st.session_state:
+    # Successful results keyed by result_cache_key, least recently used first
+    st.session_state.result_cache = OrderedDict()
+if 'stats' not in st.session_state:
+    # Running totals, updated on append so reruns never rescan the history
+    st.session_state.stats = new_stats()
+
+# Tab bodies run as fragments where available (Streamlit >= 1.33) so their widgets do not rerun the whole app;
+# older versions fall back to an ordinary call
+_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
+@st.cache_resource(show_spinner=False)
+def get_system(api_key: str) -> MultiAgentSystem:
+    """One MultiAgentSystem per API key, shared by every session and rerun"""
+    return MultiAgentSystem(api_key)
 
 def initialize_system(api_key):
     """Initialize the multi-agent system"""
     try:
-        system = MultiAgentSystem(api_key)
-        st.session_state.system = system
+        st.session_state.system = get_system(api_key)
         return True, "System initialized successfully!"
     except Exception as e:
         return False, f"Failed to initialize system: {str(e)}"
 
-def process_uploaded_file(uploaded_file, thread_id=None):
-    """Process an uploaded file"""
-    if not st.session_state.system:
-        return None, "System not initialized. Please enter a valid API key."
+def record_history(filename, result):
+    """Append a result to the session history and index its position for the history filters"""
+    position = len(st.session_state.history_summary)
+    st.session_state.history_summary.append({
+        'entry_id': position,
+        'key': result_fingerprint(result),
+        'timestamp': result.timestamp,
+        'filename': filename,
+        'agent_type': result.agent_type,
+        'format': result.classification.get('format', 'Unknown'),
+        'intent': result.classification.get('intent', 'Unknown'),
+        'success': result.success,
+        'thread_id': result.thread_id
+    })
+    details = st.session_state.history_details
+    details[position] = result
+    if len(details) > DETAIL_CACHE_SIZE:
+        details.popitem(last=False)
+    st.session_state.agent_index.setdefault(result.agent_type, []).append(position)
+    st.session_state.status_index[result.success].append(position)
     
+    stats = st.session_state.stats
+    stats['total'] += 1
+    stats['success'] += result.success
+    bump_count(stats, 'agent_counts', 'top_agent', result.agent_type)
+    bump_count(stats, 'intent_counts', 'top_intent', result.classification.get('intent', 'Unknown'))
+
+def get_history_detail(entry_id):
+    """Full result for a history entry, or None if it has been evicted from the detail cache"""
+    details = st.session_state.history_details
+    result = details.get(entry_id)
+    if result is not None:
+        details.move_to_end(entry_id)
+    return result
+
+def result_cache_key(content, filename, thread_id=""):
+    """Dedup key for a submission: API key digest, content hash, filename and the user-supplied thread ID"""
+    key_digest = hashlib.sha256(st.session_state.api_key.encode('utf-8')).hexdigest()[:16]
+    return key_digest, hashlib.sha256(content).hexdigest(), filename, thread_id
+
+def cached_result(cache_key):
+    """Previously processed result for an identical submission, or None"""
+    cache = st.session_state.result_cache
+    result = cache.get(cache_key)
+    if result is not None:
+        cache.move_to_end(cache_key)
+    return result
+
+def store_result(cache_key, result):
+    """Remember a successful result so an identical submission can skip processing"""
+    if not result.success:
+        return
+    cache = st.session_state.result_cache
+    cache[cache_key] = result
+    cache.move_to_end(cache_key)
+    if len(cache) > RESULT_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def run_uploaded_file(system, uploaded_file, thread_id=None):
+    """Process an uploaded file without touching session state, so it can run in a worker thread"""
     try:
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
+        # Stream the upload to a temporary file in 1 MiB chunks rather than copying it in memory
+        suffix = Path(uploaded_file.name).suffix or '.bin'
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+            uploaded_file.seek(0)
+            shutil.copyfileobj(uploaded_file, tmp_file, length=1024 * 1024)
             tmp_file_path = tmp_file.name
         
-        # Process the file
-        result = st.session_state.system.process_file(tmp_file_path, thread_id)
-        
-        # Clean up temporary file
-        os.unlink(tmp_file_path)
-        
-        # Add to history
-        st.session_state.processing_history.append({
-            'timestamp': result.timestamp,
-            'filename': uploaded_file.name,
-            'result': result
-        })
-        
-        return result, None
+        # Process the file, removing the temporary copy even if processing fails
+        try:
+            return system.process_file(tmp_file_path, thread_id), None
+        finally:
+            os.unlink(tmp_file_path)
         
     except Exception as e:
         return None, f"Error processing file: {str(e)}"
 
-def process_text_input(text_content, filename="text_input.txt", thread_id=None):
-    """Process text input directly"""
+def process_text_input(text_content, filename="text_input.txt", thread_id=None, cache_key=None):
+    """Process text input directly, reusing the result of an identical earlier submission"""
     if not st.session_state.system:
         return None, "System not initialized. Please enter a valid API key."
     
     try:
-        result = st.session_state.system.process_input(text_content, filename, thread_id)
+        result = cached_result(cache_key) if cache_key else None
+        if result is None:
+            result = st.session_state.system.process_input(text_content, filename, thread_id)
+            if cache_key:
+                store_result(cache_key, result)
         
         # Add to history
-        st.session_state.processing_history.append({
-            'timestamp': result.timestamp,
-            'filename': filename,
-            'result': result
-        })
+        record_history(filename, result)
         
         return result, None
         
     except Exception as e:
         return None, f"Error processing text: {str(e)}"
 
-def display_result(result: ProcessingResult, container_key=None):
-    """Display processing result in a formatted way"""
+# Results never change once recorded, so their frames are memoized on an identifying fingerprint.
+# The underscore-prefixed arguments are not hashed by Streamlit; the fingerprint stands in for them.
+# pandas is imported inside the builders so cold start does not pay for it until a table is shown.
+@st.cache_data(max_entries=256, show_spinner=False)
+def fields_df(fingerprint, _extracted):
+    """Field/value table for a result's extracted data"""
+    import pandas as pd
+    return pd.DataFrame(list(_extracted.items()), columns=['Field', 'Value'])
+
+_HISTORY_COLS = ['Timestamp', 'Filename', 'Agent', 'Format', 'Intent', 'Status', 'Thread ID']
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def history_df(fingerprint, _entries):
+    """History table for a page of summary entries, most recent first"""
+    import pandas as pd
     
-    # Create unique key for this result
-    if container_key is None:
-        container_key = result.thread_id
+    # Tuples in _HISTORY_COLS order; the column list is declared rather than inferred from dict keys
+    records = [
+        (
+            entry['timestamp'][:19],
+            entry['filename'],
+            entry['agent_type'],
+            entry['format'],
+            entry['intent'],
+            '✅ Success' if entry['success'] else '❌ Failed',
+            entry['thread_id']
+        )
+        for entry in reversed(_entries)  # Most recent first
+    ]
+    df = pd.DataFrame.from_records(records, columns=_HISTORY_COLS)
+    
+    # Keep the serialized table small: repeated labels as categories, long free text clipped
+    for column in ('Agent', 'Format', 'Intent', 'Status'):
+        df[column] = df[column].astype('category')
+    for column, width in (('Thread ID', 24), ('Filename', 40)):
+        df[column] = df[column].where(df[column].str.len() <= width, df[column].str.slice(0, width - 1) + '…')
+    return df
+
+def metrics_html(metrics):
+    """One HTML table row of label/value pairs styled like st.metric, rendered as a single element"""
+    cells = "".join(
+        f"<td>{html.escape(str(label))}<b>{html.escape(str(value))}</b></td>"
+        for label, value in metrics
+    )
+    return f"<table class='metrics'><tr>{cells}</tr></table>"
+
+def result_fingerprint(result):
+    """Key that identifies one recorded result across reruns"""
+    return f"{result.thread_id}|{result.timestamp}|{result.agent_type}"
+
+def display_result(result: ProcessingResult):
+    """Display processing result in a formatted way"""
     
     # Status indicator
     if result.success:
@@ -157,9 +241,10 @@ def display_result(result: ProcessingResult, container_key=None):
         # Agent and classification info
         col1, col2, col3 = st.columns(3)
         with col1:
-            agent_class = result.agent_type.replace('_', '-')
-            st.markdown(f'<span class="agent-badge {agent_class}">{result.agent_type.upper()}</span>', 
-                       unsafe_allow_html=True)
+            badge = AGENT_BADGES.get(result.agent_type)
+            if badge is None:
+                badge = f'<span class="agent-badge {result.agent_type.replace("_", "-")}">{result.agent_type.upper()}</span>'
+            st.markdown(badge, unsafe_allow_html=True)
         with col2:
             st.write(f"**Thread ID:** {result.thread_id}")
         with col3:
@@ -167,33 +252,31 @@ def display_result(result: ProcessingResult, container_key=None):
         
         # Classification details
         st.subheader("📊 Classification")
-        class_col1, class_col2, class_col3 = st.columns(3)
-        with class_col1:
-            st.metric("Format", result.classification.get('format', 'Unknown'))
-        with class_col2:
-            st.metric("Intent", result.classification.get('intent', 'Unknown'))
-        with class_col3:
-            st.metric("Confidence", result.classification.get('confidence', 'Unknown'))
+        st.markdown(metrics_html((
+            ("Format", result.classification.get('format', 'Unknown')),
+            ("Intent", result.classification.get('intent', 'Unknown')),
+            ("Confidence", result.classification.get('confidence', 'Unknown'))
+        )), unsafe_allow_html=True)
         
         if result.success:
             # Display extracted data based on agent type
             st.subheader("📋 Extracted Data")
             
             if result.agent_type == "json_agent":
-                display_json_result(result.data, container_key)
+                display_json_result(result.data, result_fingerprint(result))
             elif result.agent_type == "email_agent":
-                display_email_result(result.data, container_key)
+                display_email_result(result.data)
             else:
                 st.json(result.data)
         else:
             # Display errors
             st.subheader("❌ Errors")
-            for error in result.errors or []:
-                st.error(error)
+            if result.errors:
+                st.error("\n\n".join(result.errors))
         
         st.markdown('</div>', unsafe_allow_html=True)
 
-def display_json_result(data, container_key):
+def display_json_result(data, fingerprint=None):
     """Display JSON agent results"""
     extracted = data.get('extracted_data', {})
     anomalies = data.get('anomalies', [])
@@ -201,7 +284,11 @@ def display_json_result(data, container_key):
     # Extracted fields
     st.write("**Extracted Fields:**")
     if extracted:
-        df = pd.DataFrame(list(extracted.items()), columns=['Field', 'Value'])
+        if fingerprint:
+            df = fields_df(fingerprint, extracted)
+        else:
+            import pandas as pd
+            df = pd.DataFrame(list(extracted.items()), columns=['Field', 'Value'])
         st.dataframe(df, use_container_width=True)
     else:
         st.write("No fields extracted")
@@ -213,85 +300,171 @@ def display_json_result(data, container_key):
     else:
         st.warning("⚠️ Schema Issues Detected")
     
-    # Anomalies
+    # Anomalies, sent as one element rather than one per anomaly
     if anomalies:
         st.write("**⚠️ Anomalies Detected:**")
-        for anomaly in anomalies:
-            st.warning(anomaly)
+        st.warning("\n".join(f"- {anomaly}" for anomaly in anomalies))
     
-    # Toggle for raw data
-    show_raw_key = f"show_raw_{container_key}_json"
-    if show_raw_key not in st.session_state.show_raw_data:
-        st.session_state.show_raw_data[show_raw_key] = False
-    
-    if st.button(f"{'Hide' if st.session_state.show_raw_data[show_raw_key] else 'Show'} Original Data", 
-                 key=f"toggle_raw_{container_key}_json"):
-        st.session_state.show_raw_data[show_raw_key] = not st.session_state.show_raw_data[show_raw_key]
-    
-    if st.session_state.show_raw_data[show_raw_key]:
+    # Raw data; the expander keeps its own open/closed state, so nothing accumulates in session state
+    with st.expander("Original Data"):
         st.json(data.get('original_data', {}))
 
-def display_email_result(data, container_key):
+def display_email_result(data):
     """Display email agent results"""
     extracted = data.get('extracted_info', {})
     urgency = data.get('urgency_level', 'unknown')
     crm_data = data.get('crm_formatted', {})
     
-    # Key information
+    # Key information; each block is one markdown element instead of a write per line
     col1, col2 = st.columns(2)
     
     with col1:
-        st.write("**📧 Email Details:**")
-        st.write(f"**Sender:** {extracted.get('sender', 'N/A')}")
-        st.write(f"**Subject:** {extracted.get('subject', 'N/A')}")
-        st.write(f"**Sentiment:** {extracted.get('sentiment', 'N/A')}")
-        
         # Urgency with color coding
-        urgency_colors = {'high': '🔴', 'medium': '🟡', 'low': '🟢'}
-        urgency_icon = urgency_colors.get(urgency, '⚪')
-        st.write(f"**Urgency:** {urgency_icon} {urgency.upper()}")
+        urgency_icon = URGENCY_ICONS.get(urgency, '⚪')
+        st.markdown("\n\n".join([
+            "**📧 Email Details:**",
+            f"**Sender:** {extracted.get('sender', 'N/A')}",
+            f"**Subject:** {extracted.get('subject', 'N/A')}",
+            f"**Sentiment:** {extracted.get('sentiment', 'N/A')}",
+            f"**Urgency:** {urgency_icon} {urgency.upper()}"
+        ]))
     
     with col2:
-        st.write("**🎯 CRM Data:**")
-        st.write(f"**Status:** {crm_data.get('status', 'N/A')}")
-        st.write(f"**Priority:** {crm_data.get('priority', 'N/A')}")
-        st.write(f"**Category:** {crm_data.get('category', 'N/A')}")
-        st.write(f"**Contact:** {crm_data.get('contact_name', 'N/A')}")
+        st.markdown("\n\n".join([
+            "**🎯 CRM Data:**",
+            f"**Status:** {crm_data.get('status', 'N/A')}",
+            f"**Priority:** {crm_data.get('priority', 'N/A')}",
+            f"**Category:** {crm_data.get('category', 'N/A')}",
+            f"**Contact:** {crm_data.get('contact_name', 'N/A')}"
+        ]))
     
-    # Key points
+    # Key points, truncating very long ones
     key_points = extracted.get('key_points', [])
     if key_points:
-        st.write("**🔑 Key Points:**")
-        for i, point in enumerate(key_points, 1):
-            # Truncate very long points
-            display_point = point[:200] + "..." if len(point) > 200 else point
-            st.write(f"{i}. {display_point}")
+        st.markdown("**🔑 Key Points:**\n\n" + "\n".join(
+            f"{i}. {point[:200] + '...' if len(point) > 200 else point}"
+            for i, point in enumerate(key_points, 1)
+        ))
     
     # Action items
     actions = extracted.get('action_items', [])
     if actions:
-        st.write("**✅ Action Items:**")
-        for i, action in enumerate(actions, 1):
-            st.write(f"{i}. {action}")
+        st.markdown("**✅ Action Items:**\n\n" + "\n".join(
+            f"{i}. {action}" for i, action in enumerate(actions, 1)
+        ))
     
-    # Toggle for email structure
-    show_structure_key = f"show_structure_{container_key}_email"
-    if show_structure_key not in st.session_state.show_raw_data:
-        st.session_state.show_raw_data[show_structure_key] = False
+    # Email structure
+    with st.expander("Email Structure"):
+        st.json(data.get('email_structure', {}))
+
+@_fragment
+def render_latest_tab():
+    """Latest result and quick stats; widget interactions here rerun only this tab"""
+    st.header("📊 Latest Results")
     
-    if st.button(f"{'Hide' if st.session_state.show_raw_data[show_structure_key] else 'Show'} Email Structure", 
-                 key=f"toggle_structure_{container_key}_email"):
-        st.session_state.show_raw_data[show_structure_key] = not st.session_state.show_raw_data[show_structure_key]
+    if st.session_state.history_summary:
+        # Show latest result
+        latest = st.session_state.history_summary[-1]
+        st.subheader(f"📄 Latest: {latest['filename']}")
+        display_result(get_history_detail(latest['entry_id']))
+        
+        # Quick stats
+        st.subheader("📈 Quick Stats")
+        stats = st.session_state.stats
+        most_common_agent = stats['top_agent'] or "None"
+        most_common_intent = stats['top_intent'] or "None"
+        st.markdown(metrics_html((
+            ("Total Files", stats['total']),
+            ("Successful", stats['success']),
+            ("Top Agent", most_common_agent),
+            ("Top Intent", most_common_intent)
+        )), unsafe_allow_html=True)
+    else:
+        st.info("No processing results yet. Upload files or enter text to get started!")
+
+@_fragment
+def render_history_tab():
+    """Filterable, paged history with a detail view; widget interactions here rerun only this tab"""
+    st.header("📈 Processing History")
     
-    if st.session_state.show_raw_data[show_structure_key]:
-        st.json(data.get('email_structure', {}))
+    if st.session_state.history_summary:
+        history = st.session_state.history_summary
+        
+        # Filters
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            agent_filter = st.selectbox(
+                "Filter by Agent",
+                ["All"] + sorted(st.session_state.agent_index)
+            )
+        
+        with col2:
+            status_filter = st.selectbox(
+                "Filter by Status",
+                ["All", "Success", "Failed"]
+            )
+        
+        # Apply filters through the position indexes instead of scanning the whole history
+        if agent_filter != "All":
+            positions = st.session_state.agent_index.get(agent_filter, [])
+            if status_filter != "All":
+                success_filter = status_filter == "Success"
+                positions = [i for i in positions if history[i]['success'] == success_filter]
+        elif status_filter != "All":
+            positions = st.session_state.status_index[status_filter == "Success"]
+        else:
+            positions = range(len(history))
+        
+        with col3:
+            page_size = st.selectbox("Rows per page", [10, 20, 50, 100], index=1)
+        
+        page_count = max(1, -(-len(positions) // page_size))
+        with col4:
+            # Keyed on the filters so a narrower result set starts again from page 1
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1,
+                                   key=f"history_page_{agent_filter}_{status_filter}_{page_size}",
+                                   help=f"{page_count} page(s); page 1 is the most recent")
+        
+        # Only the current page is materialized; page 1 holds the newest entries
+        end = len(positions) - (page - 1) * page_size
+        filtered_history = [history[i] for i in positions[max(0, end - page_size):max(0, end)]]
+        
+        # Display history table
+        if filtered_history:
+            page_key = tuple((h['key'], h['filename']) for h in filtered_history)
+            df = history_df(page_key, filtered_history)
+            st.dataframe(df, use_container_width=True)
+            
+            # Detailed view selector
+            st.subheader("📋 Detailed View")
+            if len(filtered_history) > 0:
+                # Newest first, materialized once for the labels and the selection lookup
+                newest_first = filtered_history[::-1]
+                labels = [f"{e['filename']} - {e['timestamp'][:19]}" for e in newest_first]
+                selected_index = st.selectbox(
+                    "Select entry to view details",
+                    range(len(newest_first)),
+                    format_func=labels.__getitem__
+                )
+                
+                selected_entry = newest_first[selected_index]
+                st.write(f"**File:** {selected_entry['filename']}")
+                selected_result = get_history_detail(selected_entry['entry_id'])
+                if selected_result is not None:
+                    display_result(selected_result)
+                else:
+                    st.info(f"Details for this entry were evicted (only the latest {DETAIL_CACHE_SIZE} are kept).")
+        else:
+            st.info("No results match the selected filters.")
+    else:
+        st.info("No processing history available yet.")
 
 def main():
     """Main Streamlit app"""
     
     # Header
-    st.markdown('<h1 class="main-header">🤖 Multi-Agent AI Document Processor</h1>', 
-                unsafe_allow_html=True)
+    st.markdown(HEADER_HTML, unsafe_allow_html=True)
     
     # Sidebar for configuration
     with st.sidebar:
@@ -322,18 +495,22 @@ def main():
             st.error("❌ System Not Initialized")
         
         # Processing statistics
-        if st.session_state.processing_history:
+        if st.session_state.history_summary:
             st.subheader("📊 Statistics")
-            total_processed = len(st.session_state.processing_history)
-            successful = len([h for h in st.session_state.processing_history 
-                            if h['result'].success])
+            total_processed = st.session_state.stats['total']
+            successful = st.session_state.stats['success']
             st.metric("Total Processed", total_processed)
             st.metric("Success Rate", f"{(successful/total_processed)*100:.1f}%")
+            st.metric("Detail cache", f"{len(st.session_state.history_details)}/{DETAIL_CACHE_SIZE}")
         
         # Clear history button
         if st.button("🗑️ Clear History"):
-            st.session_state.processing_history = []
-            st.session_state.show_raw_data = {}
+            st.session_state.history_summary = []
+            st.session_state.history_details = OrderedDict()
+            st.session_state.agent_index = {}
+            st.session_state.status_index = {True: [], False: []}
+            st.session_state.stats = new_stats()
+            st.session_state.result_cache = OrderedDict()
             st.success("History cleared!")
     
     # Main interface tabs
@@ -363,24 +540,60 @@ def main():
                 st.error("Please enter a valid API key first!")
             else:
                 progress_bar = st.progress(0)
+                system = st.session_state.system
+                outcomes = [None] * len(uploaded_files)
                 
-                for i, uploaded_file in enumerate(uploaded_files):
-                    st.write(f"Processing: **{uploaded_file.name}**")
-                    
-                    # Generate thread ID if not provided
-                    current_thread_id = thread_id if thread_id else f"file_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{i}"
-                    
-                    result, error = process_uploaded_file(uploaded_file, current_thread_id)
+                # Identical re-uploads reuse their earlier result instead of going back to the LLM
+                cache_keys = []
+                for f in uploaded_files:
+                    # getbuffer() hashes the upload in place instead of copying it like getvalue()
+                    with f.getbuffer() as view:
+                        cache_keys.append(result_cache_key(view, f.name, thread_id))
+                
+                # Uncached files grouped by key, so duplicates within one batch are processed once
+                pending = {}
+                for i, cache_key in enumerate(cache_keys):
+                    result = cached_result(cache_key)
+                    if result is not None:
+                        outcomes[i] = (result, None)
+                    else:
+                        pending.setdefault(cache_key, []).append(i)
+                done = len(uploaded_files) - sum(len(positions) for positions in pending.values())
+                progress_bar.progress(done / len(uploaded_files))
+                
+                # Files are processed concurrently so their LLM calls overlap; workers only see the
+                # system object, and all session state and rendering stays on the script thread
+                if pending:
+                    with ThreadPoolExecutor(max_workers=min(8, len(pending))) as executor:
+                        futures = {}
+                        for cache_key, positions in pending.items():
+                            i = positions[0]
+                            # Generate thread ID if not provided
+                            current_thread_id = thread_id if thread_id else f"file_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{i}"
+                            futures[executor.submit(run_uploaded_file, system, uploaded_files[i], current_thread_id)] = cache_key
+                        
+                        for future in as_completed(futures):
+                            cache_key = futures[future]
+                            outcome = future.result()
+                            if outcome[0]:
+                                store_result(cache_key, outcome[0])
+                            for i in pending[cache_key]:
+                                outcomes[i] = outcome
+                            done += len(pending[cache_key])
+                            progress_bar.progress(done / len(uploaded_files))
+                
+                # Record and show results in upload order
+                for uploaded_file, (result, error) in zip(uploaded_files, outcomes):
+                    st.write(f"**File:** {uploaded_file.name}")
                     
                     if result:
+                        record_history(uploaded_file.name, result)
                         st.success(f"✅ Processed {uploaded_file.name}")
                         # Create a container for each result
                         with st.container():
-                            display_result(result, f"file_{i}")
+                            display_result(result)
                     else:
                         st.error(f"Error processing {uploaded_file.name}: {error}")
-                    
-                    progress_bar.progress((i + 1) / len(uploaded_files))
                 
                 st.success(f"✅ Completed processing {len(uploaded_files)} file(s)")
     
@@ -431,124 +644,24 @@ def main():
                 current_thread_id = thread_id_text if thread_id_text else f"text_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
                 
                 with st.spinner("Processing..."):
-                    result, error = process_text_input(text_content, filename, current_thread_id)
+                    cache_key = result_cache_key(text_content.encode('utf-8'), filename, thread_id_text)
+                    result, error = process_text_input(text_content, filename, current_thread_id, cache_key)
                 
                 if result:
                     st.success("✅ Processing completed!")
-                    display_result(result, "text_input")
+                    display_result(result)
                 else:
                     st.error(f"Processing failed: {error}")
     
     with tab3:
-        st.header("📊 Latest Results")
-        
-        if st.session_state.processing_history:
-            # Show latest result
-            latest = st.session_state.processing_history[-1]
-            st.subheader(f"📄 Latest: {latest['filename']}")
-            display_result(latest['result'], "latest")
-            
-            # Quick stats
-            st.subheader("📈 Quick Stats")
-            col1, col2, col3, col4 = st.columns(4)
-            
-            agent_counts = {}
-            intent_counts = {}
-            for entry in st.session_state.processing_history:
-                agent = entry['result'].agent_type
-                intent = entry['result'].classification.get('intent', 'Unknown')
-                agent_counts[agent] = agent_counts.get(agent, 0) + 1
-                intent_counts[intent] = intent_counts.get(intent, 0) + 1
-            
-            with col1:
-                st.metric("Total Files", len(st.session_state.processing_history))
-            with col2:
-                successful = len([h for h in st.session_state.processing_history if h['result'].success])
-                st.metric("Successful", successful)
-            with col3:
-                most_common_agent = max(agent_counts, key=agent_counts.get) if agent_counts else "None"
-                st.metric("Top Agent", most_common_agent)
-            with col4:
-                most_common_intent = max(intent_counts, key=intent_counts.get) if intent_counts else "None"
-                st.metric("Top Intent", most_common_intent)
-        else:
-            st.info("No processing results yet. Upload files or enter text to get started!")
+        render_latest_tab()
     
     with tab4:
-        st.header("📈 Processing History")
-        
-        if st.session_state.processing_history:
-            # Filters
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                agent_filter = st.selectbox(
-                    "Filter by Agent",
-                    ["All"] + list(set(h['result'].agent_type for h in st.session_state.processing_history))
-                )
-            
-            with col2:
-                status_filter = st.selectbox(
-                    "Filter by Status",
-                    ["All", "Success", "Failed"]
-                )
-            
-            with col3:
-                limit = st.number_input("Show last N results", min_value=5, max_value=100, value=20)
-            
-            # Apply filters
-            filtered_history = st.session_state.processing_history[-limit:]
-            
-            if agent_filter != "All":
-                filtered_history = [h for h in filtered_history if h['result'].agent_type == agent_filter]
-            
-            if status_filter != "All":
-                success_filter = status_filter == "Success"
-                filtered_history = [h for h in filtered_history if h['result'].success == success_filter]
-            
-            # Display history table
-            if filtered_history:
-                history_data = []
-                for entry in reversed(filtered_history):  # Most recent first
-                    result = entry['result']
-                    history_data.append({
-                        'Timestamp': result.timestamp[:19],
-                        'Filename': entry['filename'],
-                        'Agent': result.agent_type,
-                        'Format': result.classification.get('format', 'Unknown'),
-                        'Intent': result.classification.get('intent', 'Unknown'),
-                        'Status': '✅ Success' if result.success else '❌ Failed',
-                        'Thread ID': result.thread_id
-                    })
-                
-                df = pd.DataFrame(history_data)
-                st.dataframe(df, use_container_width=True)
-                
-                # Detailed view selector
-                st.subheader("📋 Detailed View")
-                if len(filtered_history) > 0:
-                    selected_index = st.selectbox(
-                        "Select entry to view details",
-                        range(len(filtered_history)),
-                        format_func=lambda x: f"{filtered_history[-(x+1)]['filename']} - {filtered_history[-(x+1)]['result'].timestamp[:19]}"
-                    )
-                    
-                    selected_entry = filtered_history[-(selected_index+1)]
-                    st.write(f"**File:** {selected_entry['filename']}")
-                    display_result(selected_entry['result'], f"history_{selected_index}")
-            else:
-                st.info("No results match the selected filters.")
-        else:
-            st.info("No processing history available yet.")
+        render_history_tab()
     
     # Footer
     st.markdown("---")
-    st.markdown(
-        "<div style='text-align: center; color: #666;'>"
-        "Multi-Agent AI Document Processor | Built with Streamlit"
-        "</div>",
-        unsafe_allow_html=True
-    )
+    st.markdown(FOOTER_HTML, unsafe_allow_html=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
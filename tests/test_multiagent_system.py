@@ -0,0 +1,290 @@
+import json
+import math
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from multiagent_system import (
+    BatchLLMClient, ClassifierAgent, EmailAgent, JSONAgent, LLMClient, MultiAgentSystem, SharedMemory,
+    _json_dumps, _json_loads
+)
+
+
+class JSONHelperTests(unittest.TestCase):
+    def test_wide_integers_load_exactly(self):
+        value = _json_loads('{"id": 123456789012345678901234567890}')
+        self.assertEqual(value["id"], 123456789012345678901234567890)
+
+    def test_integers_just_outside_64_bits_load_exactly(self):
+        for literal in ('-9223372036854775809', '18446744073709551616'):
+            value = _json_loads(literal)
+            self.assertIsInstance(value, int)
+            self.assertEqual(value, int(literal))
+
+    def test_nan_is_accepted(self):
+        self.assertTrue(math.isnan(_json_loads('{"a": NaN}')["a"]))
+
+    def test_invalid_json_raises_decode_error(self):
+        with self.assertRaises(json.JSONDecodeError):
+            _json_loads('{"a": ')
+
+    def test_wide_integers_dump_exactly(self):
+        big = 2 ** 70
+        self.assertEqual(json.loads(_json_dumps({"id": big}))["id"], big)
+
+
+class DateValidationTests(unittest.TestCase):
+    def test_whitespace_between_date_and_time_matches_strptime(self):
+        agent = JSONAgent(None, None)
+        for value in ('2024-01-15 10:30:00', '2024-01-15  10:30:00', '2024-01-15\t10:30:00'):
+            self.assertTrue(agent._is_valid_date(value), value)
+        self.assertFalse(agent._is_valid_date('2024-13-15 10:30:00'))
+
+
+class FieldMatchTests(unittest.TestCase):
+    def test_synonyms_are_matched_locally(self):
+        agent = JSONAgent(None, None)
+        data = {"Invoice_ID": "INV-9", "total": 12.5, "supplier": "ACME"}
+        extracted = agent._match_fields(data, ["invoice_number", "amount", "vendor", "due_date"])
+        self.assertEqual(extracted, {"invoice_number": "INV-9", "amount": 12.5, "vendor": "ACME"})
+
+
+class SourceViewTests(unittest.TestCase):
+    def setUp(self):
+        self.agent = JSONAgent(None, None)
+
+    def test_long_free_text_is_clipped_and_short_fields_kept(self):
+        data = {"notes": "word " * 3000, "vendor_name": "ACME"}
+        view = self.agent._source_view(data, {'required': ['vendor'], 'optional': []})
+        parsed = json.loads(view)
+        self.assertEqual(parsed["vendor_name"], "ACME")
+        self.assertTrue(parsed["notes"].startswith("word word"))
+        self.assertLessEqual(len(view), JSONAgent.MAX_SOURCE_CHARS)
+
+    def test_single_long_value_is_clipped(self):
+        view = self.agent._source_view({"description": "word " * 3000}, {'required': ['vendor']})
+        parsed = json.loads(view)
+        self.assertTrue(parsed["description"].startswith("word"))
+        self.assertLessEqual(len(view), JSONAgent.MAX_SOURCE_CHARS)
+
+
+
+class _Response:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class _FailingSession:
+    def post(self, url, **kwargs):
+        raise requests.ConnectionError("upload failed")
+
+
+class _RunningSession:
+    def __init__(self):
+        self.cancelled = []
+
+    def get(self, url, **kwargs):
+        return _Response({"status": "in_progress"})
+
+    def post(self, url, **kwargs):
+        self.cancelled.append(url)
+        return _Response({})
+
+
+class BatchClientTests(unittest.TestCase):
+    def test_failed_submit_clears_the_queue(self):
+        client = BatchLLMClient("key")
+        client.session = _FailingSession()
+        client.add("item_0", [{"role": "user", "content": "hi"}])
+        with self.assertRaises(requests.ConnectionError):
+            client.submit()
+        self.assertEqual(client._queued, [])
+
+    def test_wait_times_out_and_cancels(self):
+        client = BatchLLMClient("key", poll_interval=0.01)
+        client.session = _RunningSession()
+        with self.assertRaises(TimeoutError):
+            client.wait("batch_1", timeout=0.05)
+        self.assertTrue(client.session.cancelled[0].endswith("/batches/batch_1/cancel"))
+
+
+
+class ResponseCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(tempfile.mkdtemp(), "memory.db")
+        self.memory = SharedMemory(self.db_path)
+
+    def tearDown(self):
+        self.memory.close()
+
+    def test_expiry_is_stored_in_utc(self):
+        self.memory.store_cached_response("k", "cached", ttl_seconds=60)
+        self.assertEqual(self.memory.get_cached_response("k"), "cached")
+        expires_at = self.memory._conn.execute(
+            "SELECT expires_at FROM response_cache WHERE key = 'k'").fetchone()[0]
+        self.assertTrue(expires_at.endswith("+00:00"))
+
+    def test_expired_entries_are_ignored(self):
+        self.memory.store_cached_response("k", "cached", ttl_seconds=-1)
+        self.assertIsNone(self.memory.get_cached_response("k"))
+
+    def test_expired_entries_are_purged_on_open(self):
+        self.memory.store_cached_response("old", "cached", ttl_seconds=-1)
+        self.memory.store_cached_response("fresh", "cached", ttl_seconds=60)
+        self.memory.close()
+        self.memory = SharedMemory(self.db_path)
+        keys = [row[0] for row in self.memory._conn.execute("SELECT key FROM response_cache")]
+        self.assertEqual(keys, ["fresh"])
+
+
+class LLMClientTests(unittest.TestCase):
+    def test_closing_one_client_leaves_the_shared_session_open(self):
+        first, second = LLMClient("key"), LLMClient("key")
+        self.assertIs(first.session, second.session)
+        with mock.patch.object(requests.Session, "close") as session_close:
+            with first:
+                pass
+        session_close.assert_not_called()
+        self.assertIs(second.session, LLMClient("key").session)
+
+
+_URGENCY_KEYWORDS = {
+    "high": ["urgent", "asap", "immediately", "emergency", "critical", "deadline"],
+    "medium": ["soon", "priority", "important", "needed", "required"],
+    "low": ["when possible", "no rush", "fyi", "update"]
+}
+
+
+def _keyword_urgency(body):
+    """The original keyword-loop implementation, kept as the reference behaviour"""
+    body_lower = body.lower()
+    for level, keywords in _URGENCY_KEYWORDS.items():
+        if any(keyword in body_lower for keyword in keywords):
+            return level
+    return "medium"
+
+
+class UrgencyTests(unittest.TestCase):
+    def setUp(self):
+        self.agent = EmailAgent(None, None)
+
+    def test_overlapping_keywords_keep_precedence(self):
+        self.assertEqual(self.agent._assess_urgency("fyimmediately"), "high")
+        self.assertEqual(self.agent._assess_urgency("fyi, needed soon"), "medium")
+        self.assertEqual(self.agent._assess_urgency("no rush"), "low")
+        self.assertEqual(self.agent._assess_urgency("hello"), "medium")
+
+    def test_matches_keyword_loops(self):
+        # Keyword fragments glued together produce many overlapping and partial hits
+        rng = random.Random(0)
+        pieces = [keyword[:cut] for keywords in _URGENCY_KEYWORDS.values() for keyword in keywords
+                  for cut in (2, 3, len(keyword))] + [keyword[2:] for keyword in _URGENCY_KEYWORDS["high"]]
+        pieces += [" ", "x", "ASAP", "Fyi"]
+        for _ in range(20000):
+            body = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 6)))
+            self.assertEqual(self.agent._assess_urgency(body), _keyword_urgency(body), body)
+
+
+class _FakeLLM:
+    def __init__(self, response):
+        self.response = response
+        self.calls = 0
+
+    def call(self, messages, model=None, **kwargs):
+        self.calls += 1
+        return self.response
+
+
+class _FakeBatchClient:
+    def __init__(self, response):
+        self.response = response
+        self.added = []
+
+    def add(self, custom_id, messages):
+        self.added.append(custom_id)
+
+    def submit(self):
+        return "batch_1"
+
+    def wait(self, batch_id, timeout=None):
+        return {custom_id: self.response for custom_id in self.added}
+
+
+class PipelineTests(unittest.TestCase):
+    def setUp(self):
+        # SharedMemory writes shared_memory.db to the working directory
+        self._cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp())
+        self.system = MultiAgentSystem("test-key")
+        self.llm = _FakeLLM('{"intent": "General", "extracted": {}}')
+        for holder in (self.system, self.system.classifier, self.system.json_agent, self.system.email_agent):
+            holder.llm_client = self.llm
+
+    def tearDown(self):
+        self.system.shared_memory.close()
+        os.chdir(self._cwd)
+
+    def test_format_and_rules_run_once_per_document(self):
+        # Two distinct Complaint keywords make the rules decide the intent without an LLM call
+        document = "From: a@b.com\nSubject: Order\n\nThe item arrived damaged and I want a refund."
+        with mock.patch.object(ClassifierAgent, "_rule_classify", autospec=True,
+                               side_effect=ClassifierAgent._rule_classify) as rules, \
+                mock.patch.object(ClassifierAgent, "detect_format", autospec=True,
+                                  side_effect=ClassifierAgent.detect_format) as detect:
+            result = self.system.process_input(document, "order.eml", "t1")
+        self.assertEqual(result.classification["intent"], "Complaint")
+        self.assertEqual(rules.call_count, 1)
+        self.assertEqual(detect.call_count, 1)
+
+    def test_missing_files_report_the_same_error_with_and_without_batching(self):
+        with open("note.txt", "w") as f:
+            f.write("From: a@b.com\nSubject: Hello\n\nJust checking in.")
+        paths = ["missing.txt", "note.txt"]
+
+        realtime = self.system.process_files(paths)
+        self.system.batch_client = _FakeBatchClient('{"intent": "General", "extracted": {}}')
+        self.system.batch_threshold = 0
+        batched = self.system.process_files(paths)
+
+        for results in (realtime, batched):
+            self.assertEqual(results[0].errors, ["File not found: missing.txt"])
+            self.assertTrue(results[0].thread_id.endswith("_0"), results[0].thread_id)
+            self.assertTrue(results[1].thread_id.endswith("_1"), results[1].thread_id)
+            self.assertTrue(results[1].success)
+
+    def test_batch_without_client_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.system.process_batch_async([("hello", "a.txt")])
+
+    def test_batch_path_keeps_json_and_rule_hits_local(self):
+        self.system.batch_client = _FakeBatchClient(
+            '{"intent": "Invoice", "extracted": {"invoice_number": "FROM-LLM"}}')
+        invoice = json.dumps({"invoice_number": "INV-1", "amount": 10, "date": "2024-01-15", "vendor": "X"})
+        complaint = "From: a@b.com\nSubject: Order\n\nThe item arrived damaged and I want a refund."
+        plain = "From: a@b.com\nSubject: Hello\n\nJust checking in about next week."
+        batch_id = self.system.process_batch_async([(invoice, "a.json"), (complaint, "b.eml"), (plain, "c.eml")])
+        self.assertEqual(self.system.batch_client.added, ["item_2"])
+
+        results = self.system.collect_batch(batch_id)
+        self.assertEqual(results[0].data["extracted_data"]["invoice_number"], "INV-1")
+        self.assertEqual(results[1].classification["intent"], "Complaint")
+        self.assertEqual(results[2].classification["intent"], "Invoice")
+
+        # A batch with nothing for the provider is never submitted
+        local_id = self.system.process_batch_async([(invoice, "a.json")])
+        self.assertEqual(self.system.batch_client.added, ["item_2"])
+        self.assertTrue(self.system.collect_batch(local_id)[0].success)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Static page markup and render lookups for the Streamlit app.
+
+Streamlit re-executes streamlit_app.py on every rerun, but imported modules are
+cached in sys.modules, so anything defined here is built only once per process.
+"""
+
+from types import MappingProxyType
+
+# Custom CSS for better styling
+CSS = """
+<style>
+    .main-header {
+        font-size: 2.5rem;
+        color: #1f77b4;
+        text-align: center;
+        margin-bottom: 2rem;
+    }
+    .agent-badge {
+        padding: 0.25rem 0.75rem;
+        border-radius: 15px;
+        color: white;
+        font-weight: bold;
+        margin: 0.25rem;
+        display: inline-block;
+    }
+    .json-agent { background-color: #ff7f0e; }
+    .email-agent { background-color: #2ca02c; }
+    .pdf-agent { background-color: #d62728; }
+    .classifier { background-color: #9467bd; }
+    
+    .success-box {
+        padding: 1rem;
+        border-radius: 0.5rem;
+        background-color: #d4edda;
+        border: 1px solid #c3e6cb;
+        margin: 1rem 0;
+    }
+    .error-box {
+        padding: 1rem;
+        border-radius: 0.5rem;
+        background-color: #f8d7da;
+        border: 1px solid #f5c6cb;
+        margin: 1rem 0;
+    }
+    .info-box {
+        padding: 1rem;
+        border-radius: 0.5rem;
+        background-color: #d1ecf1;
+        border: 1px solid #bee5eb;
+        margin: 1rem 0;
+    }
+    .result-container {
+        border: 1px solid #dee2e6;
+        border-radius: 0.5rem;
+        padding: 1rem;
+        margin: 1rem 0;
+        background-color: #f8f9fa;
+    }
+    .metrics {
+        width: 100%;
+        table-layout: fixed;
+        border: none;
+        margin: 0.5rem 0 1rem 0;
+    }
+    .metrics td {
+        border: none;
+        padding: 0.25rem 0.5rem 0.25rem 0;
+        font-size: 0.875rem;
+        color: #555;
+        vertical-align: top;
+    }
+    .metrics td b {
+        display: block;
+        font-size: 1.75rem;
+        font-weight: 400;
+        color: #262730;
+        overflow: hidden;
+        text-overflow: ellipsis;
+        white-space: nowrap;
+    }
+</style>
+"""
+
+HEADER_HTML = '<h1 class="main-header">🤖 Multi-Agent AI Document Processor</h1>'
+
+FOOTER_HTML = (
+    "<div style='text-align: center; color: #666;'>"
+    "Multi-Agent AI Document Processor | Built with Streamlit"
+    "</div>"
+)
+
+# Read-only render lookups shared by every result display
+URGENCY_ICONS = MappingProxyType({'high': '🔴', 'medium': '🟡', 'low': '🟢'})
+AGENT_BADGES = MappingProxyType({
+    agent_type: f'<span class="agent-badge {agent_type.replace("_", "-")}">{agent_type.upper()}</span>'
+    for agent_type in ('json_agent', 'email_agent', 'classifier', 'system')
+})